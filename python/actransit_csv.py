@@ -4,11 +4,6 @@ Generate AC Transit CSV files for import into the DB.
 
 import sys
 import posixpath
-import pickle
-import re
-import numpy as np
-import matplotlib.pyplot as plt
-import datetime
 
 
 # ==============================================================================
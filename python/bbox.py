@@ -6,12 +6,38 @@ Bounding Box routines.
 
 
 import sys
+import math
 import logging
 import numpy as np
-import matplotlib.pyplot as plt
 import shapefile as shp
 import util
-from kml_routines import KML
+from kml_routines import KML, KMLChunks
+from kml_styles import write_styles, value_range, style_ids
+
+
+def reduce_by_id(ids, values):
+    '''
+    Sum values that share the same ID.
+
+    :param ids: integer array of IDs, e.g. flat grid cell IDs.
+    :param values: dictionary of arrays aligned with ids.
+
+    :return: Tuple (sorted unique IDs, dictionary of summed arrays aligned with them);
+             sums of integer arrays are integers.
+    '''
+
+    ids, inv = np.unique(ids, return_inverse=True)
+
+    sums = dict()
+    for name in values.keys():
+        v = np.asarray(values[name])
+        s = np.bincount(inv, weights=v, minlength=len(ids))
+        if np.issubdtype(v.dtype, np.integer):
+            s = np.round(s).astype(np.int64)
+        sums[name] = s
+
+    return (ids, sums)
+
 
 
 class BB:
@@ -27,6 +53,8 @@ class BB:
         :param ref_lat: origin.
         '''
 
+        self.dx = dx
+        self.dy = dy
         self.o_lat = o_lat
         self.o_lon = o_lon
 
@@ -51,13 +79,176 @@ class BB:
         :return: Tuple (row, column).
         '''
 
-        diff_lat, diff_lon = np.max([0, lat - self.o_lat]), np.max([0, lon - self.o_lon])
-        row, col = int(np.ceil(diff_lat / self.dlat)), int(np.ceil(diff_lon / self.dlon))
+        diff_lat, diff_lon = max(0, lat - self.o_lat), max(0, lon - self.o_lon)
+        row, col = int(math.ceil(diff_lat / self.dlat)), int(math.ceil(diff_lon / self.dlon))
         
         return (row, col)
 
 
 
+    def box_addresses(self, lats, lons):
+        '''
+        Vectorized box_address(): rows and columns of the boxes containing given geo locations.
+
+        :param lats: array of latitudes.
+        :param lons: array of longitudes.
+
+        :return: Tuple (rows, columns) of integer arrays.
+        '''
+
+        diff_lat = np.maximum(0, np.asarray(lats, dtype=float) - self.o_lat)
+        diff_lon = np.maximum(0, np.asarray(lons, dtype=float) - self.o_lon)
+        rows = np.ceil(diff_lat / self.dlat).astype(np.int64)
+        cols = np.ceil(diff_lon / self.dlon).astype(np.int64)
+
+        return (rows, cols)
+
+
+
+    def box_ids(self, lats, lons, num_cols):
+        '''
+        Flat box IDs (row * num_cols + column) of the boxes containing given geo locations,
+        suitable for np.bincount().
+
+        :param lats: array of latitudes.
+        :param lons: array of longitudes.
+        :param num_cols: number of columns in the grid, must exceed the largest column.
+
+        :return: Integer array of box IDs.
+        '''
+
+        rows, cols = self.box_addresses(lats, lons)
+
+        return rows * num_cols + cols
+
+
+
+    def id2address(self, ids, num_cols):
+        '''
+        Convert flat box IDs back to (rows, columns).
+
+        :param ids: array of box IDs.
+        :param num_cols: number of columns used to compute the IDs.
+
+        :return: Tuple (rows, columns) of integer arrays.
+        '''
+
+        return np.divmod(np.asarray(ids, dtype=np.int64), num_cols)
+
+
+
+    def aggregate(self, lats, lons, on, off, load):
+        '''
+        Aggregate stop level passenger counts into geo boxes.
+
+        :param lats: array of stop latitudes.
+        :param lons: array of stop longitudes.
+        :param on: array of boarding counts.
+        :param off: array of alighting counts.
+        :param load: array of passenger loads.
+
+        :return: Struct of arrays, one entry per non-empty box:
+                 {'row': ..., 'col': ..., 'on': ..., 'off': ..., 'load': ..., 'num_stops': ..., 'metric': ...},
+                 where metric is max(on, off) of the box totals.
+        '''
+
+        rows, cols = self.box_addresses(lats, lons)
+        values = {'on': on, 'off': off, 'load': load, 'num_stops': np.ones(len(rows), dtype=np.int64)}
+
+        return self.reduce(rows, cols, values)
+
+
+
+    def reduce(self, rows, cols, values):
+        '''
+        Sum values that fall into the same box.
+
+        :param rows: array of box rows.
+        :param cols: array of box columns.
+        :param values: dictionary of arrays aligned with rows and cols.
+
+        :return: Struct of arrays with 'row', 'col', summed values and 'metric' = max(on, off).
+        '''
+
+        rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+        num_cols = int(np.max(cols)) + 1 if len(cols) > 0 else 1
+        ids, sums = reduce_by_id(rows * num_cols + cols, values)
+        r, c = self.id2address(ids, num_cols)
+
+        boxes = {'row': r, 'col': c}
+        boxes.update(sums)
+        boxes['metric'] = np.maximum(boxes['on'], boxes['off'])
+
+        return boxes
+
+
+
+    def pyramid(self, boxes, num_levels=4):
+        '''
+        Build a multi-resolution pyramid from boxes aggregated on this grid.
+        Level k has boxes 2^k times larger than this grid, with the same origin,
+        and is computed by summing the boxes of level k-1, without re-binning stops.
+        Since box_address() rounds up, box row r of one level falls into row (r + 1) // 2
+        of the next level, same for columns.
+
+        :param boxes: struct of arrays returned by aggregate().
+        :param num_levels: number of levels, including this one.
+
+        :return: List of (BB, boxes) tuples from the finest to the coarsest level.
+        '''
+
+        levels = [(self, boxes)]
+
+        for k in range(1, num_levels):
+            fine_bb, fine = levels[-1]
+            bb = BB(dx=2 * fine_bb.dx, dy=2 * fine_bb.dy, o_lat=self.o_lat, o_lon=self.o_lon)
+            values = {a: fine[a] for a in fine.keys() if a not in ['row', 'col', 'metric']}
+            coarse = bb.reduce((fine['row'] + 1) // 2, (fine['col'] + 1) // 2, values)
+            levels.append((bb, coarse))
+
+        return levels
+
+
+
+    @staticmethod
+    def box_items(boxes):
+        '''
+        Iterate over boxes given either as a dictionary of dictionaries keyed by (row, column),
+        or as a struct of arrays returned by aggregate().
+
+        :return: Generator of ((row, column), attribute dictionary) tuples.
+        '''
+
+        if 'row' not in boxes:
+            for k in boxes.keys():
+                yield k, boxes[k]
+            return
+
+        attrs = [a for a in boxes.keys() if a not in ['row', 'col']]
+        columns = [np.asarray(boxes[a]).tolist() for a in attrs]
+        for i, k in enumerate(zip(np.asarray(boxes['row']).tolist(), np.asarray(boxes['col']).tolist())):
+            yield k, {a: columns[j][i] for j, a in enumerate(attrs)}
+
+
+
+    @staticmethod
+    def top(boxes, key, n):
+        '''
+        Select n boxes with the largest values of a given attribute from a struct of arrays.
+
+        :param boxes: struct of arrays returned by aggregate().
+        :param key: attribute to sort by.
+        :param n: number of boxes to keep.
+
+        :return: Struct of arrays sorted by key in descending order.
+        '''
+
+        idx = np.argsort(-np.asarray(boxes[key]), kind='stable')[0:n]
+
+        return {a: np.asarray(boxes[a])[idx] for a in boxes.keys()}
+
+
+
     def box_bounds(self, address):
         '''
         Compute bounds of a given geo box.
@@ -84,6 +275,7 @@ class BB:
         :param boxes: dictionary of dictionaries, keyed by a tuple (row,column),
                       which represents the address of a geo box.
                       Values of this dictionary are dictionaries with the same set of keys.
+                      Alternatively, struct of arrays returned by aggregate().
         :param shpfile: path to the shapefile to be generated.
         '''
 
@@ -91,9 +283,9 @@ class BB:
         w.field('Box Address', 'C', 32)
         attrs = []
 
-        for k in boxes.keys():
+        for k, box in self.box_items(boxes):
             if len(attrs) < 1:
-                for a in boxes[k].keys():
+                for a in box.keys():
                     attrs.append(a)
                     w.field(a, 'C', 32)
 
@@ -103,7 +295,7 @@ class BB:
 
             rlist = [k]
             for a in attrs:
-                rlist.append(boxes[k][a])
+                rlist.append(box[a])
 
             w.record(*tuple(rlist))
 
@@ -114,29 +306,31 @@ class BB:
 
 
 
-    def make_kml(self, boxes, kmlfile, key='metric', num_colors=10):
+    def make_kml(self, boxes, kmlfile, key='metric', num_colors=10, max_placemarks=None):
         '''
 
         :param boxes:
         :param kmlfile:
         :param key:
         :param num_colors:
+        :param max_placemarks: if given, split the output into linked chunk files of this many boxes, see KMLChunks.
         :return:
         '''
 
-        min, max = 0, 0
-        for k in boxes.keys():
-            b = boxes[k]
-            min, max = np.min([min, b[key]]), np.max([max, b[key]])
-        max = 0.5 * max
+        items = list(self.box_items(boxes))
 
+        values = np.array([b[key] for k, b in items], dtype=float)
+        min, max = value_range(values)
+        max = 0.5 * max
+        styles = style_ids(values, min, max, num_colors)
 
-        cmap = plt.cm.get_cmap('jet')
-        c = 255
         e = 1
 
         try:
-            K = KML(kmlfile)
+            if max_placemarks == None:
+                K = KML(kmlfile)
+            else:
+                K = KMLChunks(kmlfile, max_placemarks)
         except IOError as err:
             logging.error("make_kml(): Cannot open KML file \"{}\": {}.".format(kmlfile, err.strerror))
             return
@@ -144,18 +338,13 @@ class BB:
             logging.error("make_kml(): Cannot open KML file \"{}\": {}.".format(kmlfile, sys.exc_info()[0]))
             return
 
-        for i in range(int(num_colors) + 1):
-            style_id = "clr{}".format(i)
-            clr = cmap(float(i) / num_colors)
-            color = "7F{:02X}{:02X}{:02X}".format(int(c * clr[2]), int(c * clr[1]), int(c * clr[0]))
-            K.style(style_id, poly_color=color)
+        write_styles(K, num_colors, alpha="7F")
 
-        for k in boxes.keys():
-            b = boxes[k]
-            if float(b[key]) < 2000:
+        for i, (k, b) in enumerate(items):
+            if values[i] < 2000:
                 continue
             bb = self.box_bounds(k)
-            style_id = "#clr{}".format(np.min([num_colors, int(np.round((float(b[key])-min) * num_colors / float(max-min)))]))
+            style_id = "#clr{}".format(styles[i])
             name = "{}".format(k)
 
             desc = ""
@@ -179,6 +368,28 @@ class BB:
 
 
 
+def export_pyramid(levels, prefix, key='metric', num_colors=10, kmz=False):
+    '''
+    Export every level of a pyramid built by BB.pyramid() to its own shapefile and KML file,
+    named <prefix>_<dx>m.shp and <prefix>_<dx>m.kml (or .kmz).
+
+    :param levels: list of (BB, boxes) tuples.
+    :param prefix: path prefix of the generated files.
+    :param key: attribute used for coloring the KML.
+    :param num_colors: number of colors in the KML.
+    :param kmz: write zipped KMZ files instead of plain KML.
+    '''
+
+    for bb, boxes in levels:
+        name = "{}_{}m".format(prefix, int(bb.dx))
+        bb.make_shapefile(boxes, name + ".shp")
+        bb.make_kml(boxes, name + (".kmz" if kmz else ".kml"), key=key, num_colors=num_colors)
+
+    return
+
+
+
+
 #==============================================================================
 # Main function.
 #==============================================================================
@@ -17,13 +17,11 @@ import shapefile as shp
 #==============================================================================
 
 def points2string(points):
-    str = ""
-    for p in points:
-        if str != "":
-            str += " "
-        str += "{},{}".format(p[0], p[1])
+    # (N, 2) arrays from shp.Reader(..., numpy=True) are converted to lists in one call
+    if hasattr(points, "tolist"):
+        points = points.tolist()
 
-    return str
+    return " ".join(["{},{}".format(p[0], p[1]) for p in points])
 
 
 
@@ -36,18 +34,14 @@ def make_census_tracts_csv(out_tsv, shpfile, p_id, p_name):
 
 
     try:
-        sf = shp.Reader(shpfile)
+        sf = shp.Reader(shpfile, mmap=True)
     except:
         print("Cannot open shapefile '{}'...".format(shpfile))
 
     shapes = sf.shapes()
-    records = sf.records()
-    params = sf.fields
-    sz = len(params)
-    idx = dict()
-    for i in range(sz):
-        if (params[i][0] in [p_id, p_name]):
-            idx[params[i][0]] = i - 1
+    columns = sf.records_columns([p_id, p_name])
+    full_ids = columns[p_id].tolist()
+    names = columns[p_name].tolist()
 
     sz = sf.numRecords
 
@@ -55,8 +49,8 @@ def make_census_tracts_csv(out_tsv, shpfile, p_id, p_name):
     ofp.write("census tract\tfull id\tshape\n")
 
     for i in range(sz):
-        full_id = records[i][idx[p_id]]
-        name = records[i][idx[p_name]]
+        full_id = full_ids[i]
+        name = names[i]
         tract = name.split(" ")[-1]
 
         points = shapes[i].points
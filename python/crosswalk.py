@@ -0,0 +1,253 @@
+"""
+
+Census tract to ZIP code crosswalk.
+
+Tract-ZIP pairs from tract2zips.csv and zip2tracts.csv are integer coded,
+and stored as CSR arrays in both directions, so that tract- or stop-level
+vectors are rolled up to ZIP codes with one sparse matrix-vector product
+(np.bincount over the pairs).
+
+"""
+
+
+import sys
+import posixpath
+import numpy as np
+
+
+# county FIPS codes (state + county) of the nine Bay Area counties
+BAY_AREA_COUNTIES = ['06001', '06013', '06041', '06055', '06075', '06081', '06085', '06095', '06097']
+
+
+
+def tract_name(tractce):
+    '''
+    Convert 6-digit tract code (TRACTCE) to tract name as used for CT keys,
+    e.g. '428600' -> '4286', '428601' -> '4286.01'.
+    '''
+
+    tractce = "{:06d}".format(int(tractce))
+    name = str(int(tractce[:4]))
+    if tractce[4:] != "00":
+        name += "." + tractce[4:]
+
+    return name
+
+
+
+class CW:
+
+    geoids = None
+    tractces = None
+    names = None
+    zips = None
+    pair_tracts = None
+    pair_zips = None
+    t2z_ptr = None
+    t2z_zips = None
+    z2t_ptr = None
+    z2t_tracts = None
+    counties = None
+
+
+    def __init__(self, t2zfile="tract2zips.csv", z2tfile="zip2tracts.csv", counties=BAY_AREA_COUNTIES):
+        '''
+        Constructor...
+
+        :param t2zfile: CSV file with columns TRACTCE, GEOID, ZIP_CODE_5.
+        :param z2tfile: CSV file with columns ZIP_CODE_5, TRACTCE, GEOID.
+        :param counties: list of county FIPS codes (e.g. '06075') tract codes and
+                         names are resolved in, None for all counties.
+        '''
+
+        self.counties = counties
+
+        pairs = set()
+
+        for csvfile, i_geoid, i_zip in [(t2zfile, 1, 2), (z2tfile, 2, 0)]:
+            if not posixpath.isfile(csvfile):
+                continue
+            with open(csvfile, "r") as csv:
+                line = csv.readline().strip()
+                line = csv.readline().strip()
+
+                while line:
+                    subs = line.split(",")
+                    pairs.add((subs[i_geoid], subs[i_zip]))
+                    line = csv.readline().strip()
+
+                csv.close()
+
+        pairs = sorted(pairs)
+        geoids = np.array([p[0] for p in pairs], dtype=str)
+        zips = np.array([p[1] for p in pairs], dtype=str)
+
+        self.geoids, self.pair_tracts = np.unique(geoids, return_inverse=True)
+        self.zips, self.pair_zips = np.unique(zips, return_inverse=True)
+        self.tractces = np.array([g[-6:] for g in self.geoids], dtype=str)
+        self.names = np.array([tract_name(t) for t in self.tractces], dtype=str)
+
+        # pairs are sorted by tract, so they are the tract->zip CSR already
+        self.t2z_ptr = self.make_ptr(self.pair_tracts, len(self.geoids))
+        self.t2z_zips = self.pair_zips.astype(np.int32)
+
+        order = np.lexsort((self.pair_tracts, self.pair_zips))
+        self.z2t_ptr = self.make_ptr(self.pair_zips, len(self.zips))
+        self.z2t_tracts = self.pair_tracts[order].astype(np.int32)
+
+        return
+
+
+
+    @staticmethod
+    def make_ptr(rows, num_rows):
+        '''
+        CSR row pointer array for sorted row indices.
+        '''
+
+        ptr = np.zeros(num_rows + 1, dtype=np.int64)
+        ptr[1:] = np.cumsum(np.bincount(rows, minlength=num_rows))
+
+        return ptr
+
+
+
+    def tract_codes(self, keys, kind='geoid'):
+        '''
+        Integer codes of tracts.
+
+        :param keys: array of tract keys.
+        :param kind: 'geoid' (11 digits), 'tractce' (6 digits) or 'name' (CT key, e.g. '4286.01').
+                     Tract codes and names are only unique within a county,
+                     for those only tracts in self.counties are matched.
+
+        :return: Integer array of tract codes, -1 for unknown tracts.
+        '''
+
+        table = {'geoid': self.geoids, 'tractce': self.tractces, 'name': self.names}[kind]
+        keys = np.asarray(keys).astype(str).ravel()
+
+        order = np.argsort(table, kind='stable')
+        if kind != 'geoid' and self.counties != None:
+            in_counties = np.isin(np.array([g[:5] for g in self.geoids], dtype=str), self.counties)
+            order = order[in_counties[order]]
+        sorted_table = table[order]
+        if len(sorted_table) < 1:
+            return np.full(keys.size, -1, dtype=np.int64)
+
+        i = np.minimum(np.searchsorted(sorted_table, keys), len(sorted_table) - 1)
+        found = sorted_table[i] == keys
+        codes = np.where(found, order[i], -1)
+
+        j = np.minimum(i + 1, len(sorted_table) - 1)
+        ambiguous = found & (j > i) & (sorted_table[j] == keys)
+        if np.any(ambiguous):
+            raise ValueError("tract_codes(): Ambiguous tract {} {}, give GEOIDs or restrict counties."
+                             .format(kind, ", ".join(sorted(set(keys[ambiguous].tolist())))))
+
+        return codes.astype(np.int64)
+
+
+
+    def zips_of_tract(self, geoid):
+        '''
+        List of ZIP codes overlapping a tract given by GEOID.
+        '''
+
+        t = self.tract_codes([geoid])[0]
+        if t < 0:
+            return []
+
+        return [str(z) for z in self.zips[self.t2z_zips[self.t2z_ptr[t]:self.t2z_ptr[t + 1]]]]
+
+
+
+    def tracts_of_zip(self, zip_code):
+        '''
+        List of tract GEOIDs overlapping a ZIP code.
+        '''
+
+        z = np.searchsorted(self.zips, str(zip_code))
+        if z >= len(self.zips) or self.zips[z] != str(zip_code):
+            return []
+
+        return [str(g) for g in self.geoids[self.z2t_tracts[self.z2t_ptr[z]:self.z2t_ptr[z + 1]]]]
+
+
+
+    def tracts_to_zips(self, keys, values, kind='geoid', split=True):
+        '''
+        Roll tract-level values up to ZIP codes.
+
+        :param keys: array of tract keys, may repeat (e.g. one per stop).
+        :param values: array of values, one per key, or 2D array with one row per key.
+        :param kind: kind of tract keys, see tract_codes().
+        :param split: if True, a tract value is split evenly among the ZIP codes of
+                      the tract, so that totals are preserved; if False, every ZIP
+                      code of the tract gets the full value.
+
+        :return: Array of values aligned with self.zips (2D if values are 2D).
+        '''
+
+        values = np.asarray(values, dtype=float)
+        if values.ndim == 2:
+            return np.column_stack([self.tracts_to_zips(keys, values[:, j], kind, split)
+                                    for j in range(values.shape[1])])
+
+        codes = self.tract_codes(keys, kind)
+        valid = codes >= 0
+        num_tracts = len(self.geoids)
+        tract_values = np.bincount(codes[valid], weights=values[valid], minlength=num_tracts)
+
+        weights = tract_values[self.pair_tracts]
+        if split:
+            weights = weights / np.diff(self.t2z_ptr)[self.pair_tracts]
+
+        return np.bincount(self.pair_zips, weights=weights, minlength=len(self.zips))
+
+
+
+    def stops_to_zips(self, ct, stop_ids, values, split=True):
+        '''
+        Roll stop-level values up to ZIP codes via the stop-to-tract map of a CT object.
+        Tract names are resolved within self.counties, see tract_codes().
+
+        :param ct: CT object (can be lazy).
+        :param stop_ids: array of stop IDs.
+        :param values: array of values, one per stop, or 2D array with one row per stop.
+        :param split: see tracts_to_zips().
+
+        :return: Array of values aligned with self.zips.
+        '''
+
+        keys = ct.tract_addresses_by_stop(stop_ids)
+        keys = np.array([k if k != None else "" for k in keys], dtype=str)
+
+        return self.tracts_to_zips(keys, values, kind='name', split=split)
+
+
+
+
+
+
+
+
+
+#==============================================================================
+# Main function.
+#==============================================================================
+def main(argv):
+    print(__doc__)
+
+    cw = CW()
+    print("{} tracts, {} ZIP codes, {} pairs.".format(len(cw.geoids), len(cw.zips), len(cw.pair_zips)))
+
+
+
+
+
+
+
+
+if __name__ == "__main__":
+    main(sys.argv)
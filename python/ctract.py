@@ -6,77 +6,417 @@ Bounding Box routines.
 
 
 import sys
+import math
 import logging
 import numpy as np
+import os
+import hashlib
 import posixpath
-import matplotlib.pyplot as plt
 import shapefile as shp
 import util
-from shapely.geometry import Point
-from shapely.geometry.polygon import Polygon
+from bbox import BB
 from kml_routines import KML
+from kml_styles import write_styles, value_range, style_ids
+
+
+def parse_tract_tsv(ctfile):
+    '''
+    Parse TSV file with Census tract geometry into flat arrays.
+
+    :param ctfile: name of a TSV file with Census tract geometry.
+
+    :return: Dictionary with 'keys', 'full_ids', 'coords' ((N, 2) array of [lon, lat])
+             and 'offsets' (coordinates of tract i are coords[offsets[i]:offsets[i+1]]).
+    '''
+
+    keys, full_ids, coords, offsets = [], [], [], [0]
+
+    with open(ctfile, "r") as tsv:
+        line = tsv.readline().strip()
+        line = tsv.readline().strip()
+
+        while line:
+            subs = line.split("\t")
+            keys.append(subs[0])
+            full_ids.append(subs[1])
+
+            points = np.array(subs[2].replace(",", " ").split(" "), dtype=float).reshape(-1, 2)
+            coords.append(points)
+            offsets.append(offsets[-1] + len(points))
+            line = tsv.readline().strip()
+
+        tsv.close()
+
+    coords = np.concatenate(coords) if len(coords) > 0 else np.zeros((0, 2))
+
+    return {'keys': np.array(keys, dtype=str), 'full_ids': np.array(full_ids, dtype=str),
+            'coords': coords.astype(np.float64), 'offsets': np.array(offsets, dtype=np.int64)}
+
+
+
+def file_signature(path, digest=False):
+    '''
+    Signature of a file used to invalidate caches: (mtime, size, sha1 or None).
+    '''
+
+    st = os.stat(path)
+    sha1 = None
+    if digest:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        sha1 = h.hexdigest()
+
+    return (st.st_mtime_ns, st.st_size, sha1)
+
+
+
+def load_tract_cache(ctfile, cache_dir=None):
+    '''
+    Load tract geometry from a binary cache next to the TSV file, (re)building the
+    cache from the TSV if it is missing or stale. The cache is a directory of .npy
+    files memory-mapped read-only, so processes loading it share the same pages.
+    The cache is stale when the TSV size differs, or when its mtime differs and
+    so does its SHA-1.
+
+    :param ctfile: name of a TSV file with Census tract geometry.
+    :param cache_dir: cache directory, default is <ctfile without extension>.cache.
+
+    :return: Dictionary with 'keys', 'full_ids', 'coords' and 'offsets' arrays.
+    '''
+
+    if cache_dir == None:
+        cache_dir = posixpath.splitext(ctfile)[0] + ".cache"
+    sig_file = posixpath.join(cache_dir, "signature.txt")
+    names = ['keys', 'full_ids', 'coords', 'offsets']
+
+    mtime, size, sha1 = file_signature(ctfile)
+    valid = False
+    if posixpath.isfile(sig_file):
+        with open(sig_file, "r") as f:
+            subs = f.read().split()
+            f.close()
+        if len(subs) == 3 and int(subs[1]) == size:
+            valid = int(subs[0]) == mtime
+            if not valid and subs[2] == file_signature(ctfile, digest=True)[2]:
+                # same content with a new mtime (checkout, touch): store the new mtime,
+                # so that the next load does not hash the file again
+                valid = True
+                try:
+                    tmp = ".{}.tmp".format(os.getpid())
+                    with open(sig_file + tmp, "w") as f:
+                        f.write("{} {} {}\n".format(mtime, size, subs[2]))
+                        f.close()
+                    os.replace(sig_file + tmp, sig_file)
+                except (IOError, OSError) as err:
+                    logging.warning("load_tract_cache(): Cannot update \"{}\": {}.".format(sig_file, err))
+
+    if valid:
+        try:
+            return {n: np.load(posixpath.join(cache_dir, n + ".npy"), mmap_mode='r') for n in names}
+        except (IOError, ValueError):
+            pass
+
+    data = parse_tract_tsv(ctfile)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = ".{}.tmp".format(os.getpid())
+        for n in names:
+            np.save(posixpath.join(cache_dir, n + tmp + ".npy"), data[n])
+            os.replace(posixpath.join(cache_dir, n + tmp + ".npy"), posixpath.join(cache_dir, n + ".npy"))
+        with open(sig_file + tmp, "w") as f:
+            f.write("{} {} {}\n".format(mtime, size, file_signature(ctfile, digest=True)[2]))
+            f.close()
+        os.replace(sig_file + tmp, sig_file)
+    except (IOError, OSError) as err:
+        logging.warning("load_tract_cache(): Cannot write cache \"{}\": {}.".format(cache_dir, err))
+        return data
+
+    return {n: np.load(posixpath.join(cache_dir, n + ".npy"), mmap_mode='r') for n in names}
+
+
+
+def points_in_ring(lats, lons, ring, chunk_size=1000000):
+    '''
+    Even-odd (ray casting) test of many points against a single ring.
+
+    :param lats: array of latitudes.
+    :param lons: array of longitudes.
+    :param ring: sequence of [lon, lat] vertices.
+    :param chunk_size: upper bound on the number of point-edge pairs evaluated at once.
+
+    :return: Boolean array, True for points inside the ring.
+    '''
+
+    ring = np.asarray(ring, dtype=float)
+    x0, y0 = ring[:, 0], ring[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+
+    inside = np.zeros(len(lats), dtype=bool)
+    step = max(1, chunk_size // max(1, len(x0)))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for s in range(0, len(lats), step):
+            py = lats[s:s + step, np.newaxis]
+            px = lons[s:s + step, np.newaxis]
+            crosses = ((y0 > py) != (y1 > py)) & (px < (x1 - x0) * (py - y0) / (y1 - y0) + x0)
+            inside[s:s + step] = (np.count_nonzero(crosses, axis=1) % 2) == 1
+
+    return inside
+
 
 
 class CT:
 
     tracts = None
-    stop2tract = None
+    stop_ids = None
+    stop_tracts = None
+    keys = None
+    polygons = None
+    coords = None
+    offsets = None
+    index = None
+    bounds = None
+    grid = None
 
     
-    def __init__(self, ctfile="ba_census_tracts.tsv", stfile="stop2tract.csv"):
+    def __init__(self, ctfile="ba_census_tracts.tsv", stfile="stop2tract.csv", cell_size=500, lazy=False):
         '''
         Constructor...
 
         :param ctfile: name of a TSV file with Census tract geometry.
+        :param stfile: name of a CSV file mapping stop IDs to tracts.
+        :param cell_size: size of the lookup grid cell in meters.
+        :param lazy: if True, only the stop-to-tract map is loaded here, and tract
+                     geometry is loaded on first use.
         '''
 
-        self.tracts = dict()
-
-        with open(ctfile, "r") as tsv:
-            line = tsv.readline().strip()
-            line = tsv.readline().strip()
-            count = 1
-
-            while line:
-                subs = line.split("\t")
-                key = subs[0]
-                full_id = subs[1]
-                coord_str = subs[2]
-
-                ptsubs = coord_str.split(" ")
-                points = []
-                for pts in ptsubs:
-                    lonlat = pts.split(",")
-                    points.append([float(lonlat[0]), float(lonlat[1])])
-
-                entry = {'full_id': full_id, 'geometry_str': coord_str, 'geometry': points}
-                entry = {'full_id': full_id, 'geometry': points}
-                self.tracts[key] = entry
-                line = tsv.readline().strip()
-                count += 1
-
-            tsv.close()
+        self.ctfile = ctfile
+        self.cell_size = cell_size
 
         if posixpath.isfile(stfile):
-            self.stop2tract = dict()
+            ids, tracts = [], []
             with open(stfile, "r") as csv:
                 line = csv.readline().strip()
                 line = csv.readline().strip()
 
                 while line:
                     subs = line.split(",")
-                    self.stop2tract[int(subs[0])] = subs[1]
+                    if subs[1] != "":
+                        ids.append(int(subs[0]))
+                        tracts.append(subs[1])
                     line = csv.readline().strip()
 
                 csv.close()
 
+            ids = np.array(ids, dtype=np.int64)
+            order = np.argsort(ids, kind='stable')
+            self.stop_ids = ids[order]
+            self.stop_tracts = np.array(tracts, dtype=str)[order]
+
+        if not lazy:
+            self.load_geometry()
+
         return
 
 
 
+    def load_geometry(self):
+        '''
+        Load tract geometry, spatial index and lookup grid, unless already loaded.
+        '''
+
+        if self.tracts != None:
+            return
+
+        cache = load_tract_cache(self.ctfile)
+        coords, offsets, full_ids = cache['coords'], cache['offsets'], cache['full_ids']
+
+        # a tract key repeated in the file keeps its first position and its last geometry
+        last = dict()
+        for i, key in enumerate(cache['keys']):
+            last[str(key)] = i
+        rings = np.array(list(last.values()), dtype=np.int64)
+
+        if len(rings) < len(cache['keys']):
+            lengths = offsets[rings + 1] - offsets[rings]
+            idx = np.concatenate([np.arange(offsets[i], offsets[i + 1]) for i in rings])
+            coords = coords[idx]
+            offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+            full_ids = full_ids[rings]
+
+        self.coords = coords
+        self.offsets = offsets
+
+        tracts = dict()
+        for i, key in enumerate(last.keys()):
+            geometry = self.coords[self.offsets[i]:self.offsets[i + 1]]
+            tracts[key] = {'full_id': str(full_ids[i]), 'geometry': geometry}
+        self.tracts = tracts
+
+        self.build_index()
+        self.load_grid(posixpath.splitext(self.ctfile)[0] + ".grid.npz", self.ctfile, self.cell_size)
+
+        return
+
+
+
+    def build_index(self):
+        '''
+        Build tract polygons once from the flat coordinate array, prepare them
+        for repeated containment tests and put their bounding boxes into an STR-tree.
+        Polygon i corresponds to tract key self.keys[i].
+        '''
+
+        import shapely
+        from shapely.strtree import STRtree
+
+        self.keys = list(self.tracts.keys())
+        ring_ids = np.repeat(np.arange(len(self.keys)), np.diff(self.offsets))
+        self.polygons = shapely.polygons(shapely.linearrings(self.coords, indices=ring_ids))
+        shapely.prepare(self.polygons)
+        self.index = STRtree(self.polygons)
+        self.bounds = shapely.bounds(self.polygons).reshape(-1, 4)
+
+        return
+
+
+
+    def build_grid(self, cell_size=500):
+        '''
+        Rasterize tracts onto a uniform lat/lon grid over the tract extent.
+        Every cell stores the tract that fully covers it (or -1), and cells crossed
+        by tract boundaries store a short list of candidate tracts in CSR form.
+
+        :param cell_size: size of the grid cell in meters.
+
+        :return: Dictionary with grid arrays.
+        '''
+
+        import shapely
+
+        mn_lon, mn_lat = np.min(self.bounds[:, 0]), np.min(self.bounds[:, 1])
+        mx_lon, mx_lat = np.max(self.bounds[:, 2]), np.max(self.bounds[:, 3])
+        bb = BB(dx=cell_size, dy=cell_size, o_lat=mn_lat, o_lon=mn_lon)
+        rows = max(1, int(np.ceil((mx_lat - mn_lat) / bb.dlat)))
+        cols = max(1, int(np.ceil((mx_lon - mn_lon) / bb.dlon)))
+
+        full = np.full(rows * cols, -1, dtype=np.int32)
+        cells, cands = [], []
+
+        for i, polygon in enumerate(self.polygons):
+            b = self.bounds[i]
+            r0, r1 = self.grid_cell(b[1], b[0], bb.o_lat, bb.o_lon, bb.dlat, bb.dlon, rows, cols)
+            r2, r3 = self.grid_cell(b[3], b[2], bb.o_lat, bb.o_lon, bb.dlat, bb.dlon, rows, cols)
+            rr, cc = np.meshgrid(np.arange(r0, r2 + 1), np.arange(r1, r3 + 1), indexing='ij')
+            rr, cc = rr.ravel(), cc.ravel()
+            boxes = shapely.box(bb.o_lon + cc * bb.dlon, bb.o_lat + rr * bb.dlat,
+                                bb.o_lon + (cc + 1) * bb.dlon, bb.o_lat + (rr + 1) * bb.dlat)
+            hit = shapely.intersects(polygon, boxes)
+            cover = shapely.contains_properly(polygon, boxes)
+            ids = rr * cols + cc
+
+            covered = ids[cover]
+            full[covered[full[covered] < 0]] = i
+            partial = ids[hit & ~cover]
+            cells.append(partial)
+            cands.append(np.full(partial.size, i, dtype=np.int32))
+
+        cells = np.concatenate(cells) if len(cells) > 0 else np.zeros(0, dtype=np.int64)
+        cands = np.concatenate(cands) if len(cands) > 0 else np.zeros(0, dtype=np.int32)
+        order = np.lexsort((cands, cells))
+        ptr = np.zeros(rows * cols + 1, dtype=np.int64)
+        ptr[1:] = np.cumsum(np.bincount(cells, minlength=rows * cols))
+
+        return {'origin': np.array([bb.o_lat, bb.o_lon, bb.dlat, bb.dlon]),
+                'shape': np.array([rows, cols]),
+                'cell_size': np.array(cell_size, dtype=float),
+                'keys': np.array(self.keys, dtype=str),
+                'full': full, 'ptr': ptr, 'cand': cands[order]}
+
+
+
+    def load_grid(self, grid_file, ctfile, cell_size=500):
+        '''
+        Load the tract lookup grid from disk, or build and save it if it is missing
+        or stale. The grid stores the signature of the tract file it is built from,
+        and is stale the same way as the tract cache: when the TSV size differs, or
+        when its mtime differs and so does its SHA-1.
+
+        :param grid_file: path to the grid file (.npz).
+        :param ctfile: path to the TSV file the grid is built from.
+        :param cell_size: size of the grid cell in meters.
+        '''
+
+        self.grid = None
+        mtime, size, sha1 = file_signature(ctfile)
+
+        if posixpath.isfile(grid_file):
+            with np.load(grid_file) as data:
+                grid = {k: data[k] for k in data.files}
+            valid = 'signature' in grid and int(grid['signature'][1]) == size
+            touched = False
+            if valid and int(grid['signature'][0]) != mtime:
+                valid = touched = str(grid['signature'][2]) == file_signature(ctfile, digest=True)[2]
+            if valid and float(grid['cell_size']) == float(cell_size) and list(grid['keys']) == self.keys:
+                self.grid = grid
+                if touched:
+                    # same content with a new mtime: store the new mtime,
+                    # so that the next load does not hash the file again
+                    self.grid['signature'] = np.array([mtime, size, grid['signature'][2]], dtype=str)
+                    try:
+                        np.savez(grid_file, **self.grid)
+                    except IOError as err:
+                        logging.warning("load_grid(): Cannot save grid file \"{}\": {}.".format(grid_file, err.strerror))
+
+        if self.grid == None:
+            self.grid = self.build_grid(cell_size)
+            self.grid['signature'] = np.array([mtime, size, file_signature(ctfile, digest=True)[2]], dtype=str)
+            try:
+                np.savez(grid_file, **self.grid)
+            except IOError as err:
+                logging.warning("load_grid(): Cannot save grid file \"{}\": {}.".format(grid_file, err.strerror))
+
+        return
+
+
+
+    @staticmethod
+    def grid_cell(lat, lon, o_lat, o_lon, dlat, dlon, rows, cols):
+        '''
+        Row and column of the grid cell containing (lat, lon), clipped to the grid.
+        '''
+
+        row = min(rows - 1, max(0, int(np.floor((lat - o_lat) / dlat))))
+        col = min(cols - 1, max(0, int(np.floor((lon - o_lon) / dlon))))
+
+        return (row, col)
+
+
+
+    def grid_cells(self, lats, lons):
+        '''
+        Flat grid cell IDs for arrays of locations, -1 for locations outside the grid.
+        '''
+
+        o_lat, o_lon, dlat, dlon = self.grid['origin']
+        rows, cols = self.grid['shape']
+        row = np.floor((lats - o_lat) / dlat)
+        col = np.floor((lons - o_lon) / dlon)
+        inside = (row >= 0) & (row < rows) & (col >= 0) & (col < cols)
+        cells = np.where(inside, row * cols + col, -1)
+
+        return cells.astype(np.int64)
+
+
+
     def tract_address(self, lat, lon):
         '''
         Get tract name for a given (lat, lon) if applicable.
+        The lookup grid gives either the tract covering the cell, or a few candidates
+        that get an exact containment test.
 
         :param lat: latitude of the location.
         :param lon: longitude of the location.
@@ -84,17 +424,122 @@ class CT:
         :return: Tract key.
         '''
 
-        for k in self.tracts.keys():
-            t = self.tracts[k]
-            polygon = Polygon(np.array(t['geometry']))
-            point = Point(lon, lat)
-            if polygon.contains(point): # or point.within(polygon):
-                return k
+        self.load_geometry()
+
+        o_lat, o_lon, dlat, dlon = self.grid['origin']
+        rows, cols = self.grid['shape']
+        row, col = math.floor((lat - o_lat) / dlat), math.floor((lon - o_lon) / dlon)
+        if row < 0 or row >= rows or col < 0 or col >= cols:
+            return None
+
+        cell = row * cols + col
+
+        full = self.grid['full'][cell]
+        if full >= 0:
+            return self.keys[full]
+
+        import shapely
+
+        ptr = self.grid['ptr']
+        for i in self.grid['cand'][ptr[cell]:ptr[cell + 1]]:
+            if shapely.contains_xy(self.polygons[i], lon, lat):
+                return self.keys[i]
 
         return None
 
 
 
+    def tract_addresses(self, lats, lons):
+        '''
+        Get tract names for arrays of locations.
+        Points in grid cells covered by a single tract are resolved by the grid.
+        The rest are sorted by longitude once, so that for every tract only the points
+        inside its bounding box are selected, and those are tested against the tract
+        polygon with a vectorized ray casting test.
+
+        :param lats: array of latitudes.
+        :param lons: array of longitudes.
+
+        :return: Object array of tract keys, None where a point is in no tract.
+        '''
+
+        self.load_geometry()
+
+        lats = np.asarray(lats, dtype=float).ravel()
+        lons = np.asarray(lons, dtype=float).ravel()
+
+        keys = np.full(lats.size, None, dtype=object)
+        found = np.zeros(lats.size, dtype=bool)
+
+        # points in cells fully covered by a tract need no geometry test
+        cells = self.grid_cells(lats, lons)
+        full = np.where(cells >= 0, self.grid['full'][np.maximum(cells, 0)], -1)
+        covered = full >= 0
+        keys[covered] = np.array(self.keys, dtype=object)[full[covered]]
+        found |= covered | (cells < 0)
+
+        order = np.argsort(lons, kind='stable')
+        sorted_lons = lons[order]
+
+        for i, k in enumerate(self.keys):
+            mn_lon, mn_lat, mx_lon, mx_lat = self.bounds[i]
+            a = np.searchsorted(sorted_lons, mn_lon, side='left')
+            b = np.searchsorted(sorted_lons, mx_lon, side='right')
+            if a >= b:
+                continue
+
+            idx = order[a:b]
+            idx = idx[(lats[idx] >= mn_lat) & (lats[idx] <= mx_lat) & ~found[idx]]
+            if idx.size == 0:
+                continue
+
+            inside = points_in_ring(lats[idx], lons[idx], self.tracts[k]['geometry'])
+            idx = idx[inside]
+            keys[idx] = k
+            found[idx] = True
+
+        return keys
+
+
+
+    def nearest_tract(self, lat, lon, max_distance=200):
+        '''
+        Find the tract closest to a given (lat, lon) within max_distance.
+        Intended as a fallback for locations outside all tract polygons,
+        for example stops on the shoreline. Only tracts whose bounding boxes
+        are within max_distance are considered.
+
+        :param lat: latitude of the location.
+        :param lon: longitude of the location.
+        :param max_distance: search radius in meters.
+
+        :return: Tuple (tract key, distance in meters), or (None, None) if no tract is within max_distance.
+        '''
+
+        import shapely
+
+        self.load_geometry()
+
+        # degrees per meter at the location
+        bb = BB(dx=1, dy=1, o_lat=lat, o_lon=lon)
+        r_lon, r_lat = max_distance * bb.dlon, max_distance * bb.dlat
+
+        candidates = np.sort(self.index.query(shapely.box(lon - r_lon, lat - r_lat, lon + r_lon, lat + r_lat)))
+        if len(candidates) < 1:
+            return (None, None)
+
+        lines = shapely.shortest_line(self.polygons[candidates], shapely.points(lon, lat))
+        ends = shapely.get_coordinates(lines).reshape(-1, 2, 2)[:, 0, :]
+        dist = np.hypot((ends[:, 0] - lon) / bb.dlon, (ends[:, 1] - lat) / bb.dlat)
+
+        i = np.argmin(dist)
+        if dist[i] > max_distance:
+            return (None, None)
+
+        return (self.keys[candidates[i]], float(dist[i]))
+
+
+
     def tract_address_by_stop(self, stop_id):
         '''
         Get tract name for a given stop ID if applicable.
@@ -104,16 +549,39 @@ class CT:
         :return: Tract key.
         '''
 
-        if self.stop2tract == None:
+        if self.stop_ids is None:
             return None
 
-        if stop_id in self.stop2tract.keys():
-            return self.stop2tract[stop_id]
+        i = np.searchsorted(self.stop_ids, stop_id)
+        if i < len(self.stop_ids) and self.stop_ids[i] == stop_id:
+            return str(self.stop_tracts[i])
 
         return None
 
 
 
+    def tract_addresses_by_stop(self, stop_ids):
+        '''
+        Get tract names for an array of stop IDs.
+
+        :param stop_ids: array of stop IDs.
+
+        :return: Object array of tract keys, None for stops not in the map.
+        '''
+
+        stop_ids = np.asarray(stop_ids, dtype=np.int64).ravel()
+        keys = np.full(stop_ids.size, None, dtype=object)
+        if self.stop_ids is None or len(self.stop_ids) < 1:
+            return keys
+
+        i = np.minimum(np.searchsorted(self.stop_ids, stop_ids), len(self.stop_ids) - 1)
+        found = self.stop_ids[i] == stop_ids
+        keys[found] = self.stop_tracts[i[found]].astype(object)
+
+        return keys
+
+
+
     def tract_meta(self, key):
         '''
         Compute bounds of a given geo box.
@@ -123,6 +591,8 @@ class CT:
         :return: Dictionary with the tract meta and geometry.
         '''
 
+        self.load_geometry()
+
         if key in self.tracts.keys():
             return self.tracts[key]
 
@@ -140,6 +610,8 @@ class CT:
         :param shpfile: path to the shapefile to be generated.
         '''
 
+        self.load_geometry()
+
         w = shp.Writer(shp.POLYGON)
         w.field('Tract', 'C', 32)
         attrs = []
@@ -147,7 +619,7 @@ class CT:
         for k in tracts.keys():
             if len(attrs) < 1:
                 for a in tracts[k].keys():
-                    if isinstance(tracts[k][a], dict) or isinstance(tracts[k][a], list):
+                    if isinstance(tracts[k][a], (dict, list, np.ndarray)):
                         continue
                     attrs.append(a)
                     w.field(a, 'C', 32)
@@ -184,15 +656,14 @@ class CT:
         :return:
         '''
 
-        min, max = float(sys.maxsize), 0
-        for k in tracts.keys():
-            t = tracts[k]
-            min, max = np.min([min, t[key]]), np.max([max, t[key]])
-        #max = 0.5 * max
+        self.load_geometry()
 
+        keys = list(tracts.keys())
+        values = np.array([tracts[k][key] for k in keys], dtype=float)
+        min, max = value_range(values, min=float(sys.maxsize))
+        #max = 0.5 * max
+        styles = style_ids(values, min, max, num_colors)
 
-        cmap = plt.cm.get_cmap('jet')
-        c = 255
         e = 1
 
         try:
@@ -204,22 +675,18 @@ class CT:
             logging.error("make_kml(): Cannot open KML file \"{}\": {}.".format(kmlfile, sys.exc_info()[0]))
             return
 
-        for i in range(int(num_colors) + 1):
-            style_id = "clr{}".format(i)
-            clr = cmap(float(i) / num_colors)
-            color = "7F{:02X}{:02X}{:02X}".format(int(c * clr[2]), int(c * clr[1]), int(c * clr[0]))
-            K.style(style_id, poly_color=color)
+        write_styles(K, num_colors, alpha="7F")
 
-        for k in tracts.keys():
+        for i, k in enumerate(keys):
             t = tracts[k]
-            if float(t[key]) < 2000:
+            if values[i] < 2000:
                 continue
-            style_id = "#clr{}".format(np.min([num_colors, int(np.round((float(t[key])-min) * num_colors / float(max-min)))]))
+            style_id = "#clr{}".format(styles[i])
             name = "{}".format(k)
 
             desc = ""
             for a in t.keys():
-                if isinstance(t[a], dict) or isinstance(t[a], list):
+                if isinstance(t[a], (dict, list, np.ndarray)):
                     continue
                 desc += "{}: {}\n".format(a, t[a])
 
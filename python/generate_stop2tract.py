@@ -4,12 +4,67 @@ Generate map: stop to Census tract.
 
 """
 import sys
-from ctract import CT
-import pickle
-import re
+import os
+import posixpath
+from concurrent.futures import ProcessPoolExecutor
+from ctract import CT, file_signature
 import numpy as np
-import matplotlib.pyplot as plt
-import datetime
+
+
+# ==============================================================================
+# Auxiliary functions
+# ==============================================================================
+
+# tract lookup of a worker process, see init_worker()
+worker_ct = None
+
+
+def init_worker(tract_file):
+    '''
+    Initialize worker process: tract geometry comes from the memory-mapped cache,
+    so all workers share the same pages instead of receiving pickled copies.
+    '''
+
+    global worker_ct
+    worker_ct = CT(ctfile=tract_file, stfile="")
+
+    return
+
+
+
+def geocode_chunk(chunk):
+    lats, lons = chunk
+    return worker_ct.tract_addresses(lats, lons)
+
+
+
+def geocode(tract_file, lats, lons, workers=1):
+    '''
+    Find tracts for arrays of locations, optionally sharding them across processes.
+
+    :param tract_file: TSV file with Census tract geometry.
+    :param lats: array of latitudes.
+    :param lons: array of longitudes.
+    :param workers: number of worker processes.
+
+    :return: Object array of tract keys in the order of input, None for misses.
+    '''
+
+    # also builds the geometry cache and lookup grid before any worker needs them
+    ct = CT(ctfile=tract_file, stfile="")
+
+    if workers <= 1 or len(lats) < 2 * workers:
+        return ct.tract_addresses(lats, lons)
+
+    shards = np.array_split(np.arange(len(lats)), 4 * workers)
+    chunks = [(lats[s], lons[s]) for s in shards if len(s) > 0]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(tract_file,)) as ex:
+        results = list(ex.map(geocode_chunk, chunks))
+
+    return np.concatenate(results)
+
+
 
 
 # ==============================================================================
@@ -35,28 +90,139 @@ def load_stops(stop_file):
 
 
 
-def make_stop2tract(stop_files, tract_file, map_file):
-    ct = CT(ctfile=tract_file)
+def load_stop2tract(map_file):
+    '''
+    Load existing stop to tract map.
 
-    with open(map_file, "w+") as mfp:
-        mfp.write("stop_id,tract\n")
+    :param map_file: CSV file with columns stop_id, tract and, optionally, latitude, longitude.
+
+    :return: Dictionary keyed by stop ID with 'tract', 'latitude' and 'longitude'
+             (tract is None for stops outside all tracts, coordinates are None
+             if the map does not have them).
+    '''
+
+    s2t = dict()
+
+    with open(map_file, "r") as fp:
+        line = fp.readline().strip()
+        line = fp.readline().strip()
+        while line:
+            entries = line.split(",")
+            attr = {'tract': entries[1] if entries[1] != "" else None, 'latitude': None, 'longitude': None}
+            if len(entries) >= 4:
+                attr['latitude'], attr['longitude'] = float(entries[2]), float(entries[3])
+            s2t[entries[0]] = attr
+            line = fp.readline().strip()
+
+        fp.close()
+    return s2t
+
+
+
+def tract_file_changed(tract_file, sig_file):
+    '''
+    Check if the tract file differs from the one a stop to tract map was made with.
+    As with the tract cache, it differs when its size does, or when its mtime
+    and SHA-1 both do.
+
+    :param tract_file: TSV file with Census tract geometry.
+    :param sig_file: file with the signature of the tract file used for the map.
+
+    :return: True if it changed or the signature is missing.
+    '''
+
+    if not posixpath.isfile(sig_file):
+        return True
+
+    with open(sig_file, "r") as f:
+        subs = f.read().split()
+        f.close()
+
+    mtime, size, sha1 = file_signature(tract_file)
+    if len(subs) != 3 or int(subs[1]) != size:
+        return True
 
-        for stop_file in stop_files:
-            print("Processing '{}'...".format(stop_file))
-            stops = load_stops(stop_file)
+    return int(subs[0]) != mtime and subs[2] != file_signature(tract_file, digest=True)[2]
 
-            for k in stops:
-                s = stops[k]
-                tract = ct.tract_address(float(s['latitude']), float(s['longitude']))
-                if tract == None:
-                    print("{} - {}: no tract.".format(k, s['stop_name']))
-                    continue
 
-                mfp.write("{},{}\n".format(k, tract))
+
+def make_stop2tract(stop_files, tract_file, map_file, incremental=False, tolerance=1e-5, workers=1):
+    '''
+    Generate stop to tract map.
+    The signature of the tract file is saved next to the map in <map_file>.sig.
+
+    :param stop_files: list of CSV files with stop_id, stop_name, latitude, longitude.
+    :param tract_file: TSV file with Census tract geometry.
+    :param map_file: CSV file to be generated.
+    :param incremental: if True and map_file exists, only stops that are new or moved
+                        by more than tolerance are geocoded, the rest keep their tracts;
+                        all stops are geocoded if the tract file has changed since.
+    :param tolerance: coordinate change (in degrees) above which a stop is geocoded again.
+    :param workers: number of processes used for geocoding.
+
+    :return: Dictionary with lists of 'added', 'changed', 'removed' and 'unresolved' stop IDs.
+    '''
+
+    sig_file = map_file + ".sig"
+
+    old = dict()
+    if incremental and posixpath.isfile(map_file):
+        if tract_file_changed(tract_file, sig_file):
+            print("Tract file '{}' has changed, geocoding all stops.".format(tract_file))
+        else:
+            old = load_stop2tract(map_file)
+
+    stops = dict()
+    for stop_file in stop_files:
+        print("Processing '{}'...".format(stop_file))
+        stops.update(load_stops(stop_file))
+
+    ids = list(stops.keys())
+    lats = np.array([float(stops[k]['latitude']) for k in ids])
+    lons = np.array([float(stops[k]['longitude']) for k in ids])
+
+    report = {'added': [], 'changed': [], 'removed': [], 'unresolved': []}
+    todo = np.ones(len(ids), dtype=bool)
+    for i, k in enumerate(ids):
+        if k not in old.keys():
+            report['added'].append(k)
+            continue
+        o = old[k]
+        if o['latitude'] == None or abs(o['latitude'] - lats[i]) > tolerance or abs(o['longitude'] - lons[i]) > tolerance:
+            report['changed'].append(k)
+            continue
+        todo[i] = False
+    report['removed'] = [k for k in old.keys() if k not in stops.keys()]
+
+    tracts = np.array([old[k]['tract'] if k in old.keys() else None for k in ids], dtype=object)
+    if np.any(todo):
+        tracts[todo] = geocode(tract_file, lats[todo], lons[todo], workers=workers)
+
+    with open(map_file, "w+") as mfp:
+        mfp.write("stop_id,tract,latitude,longitude\n")
+
+        for i, k in enumerate(ids):
+            tract = tracts[i]
+            if tract == None:
+                if todo[i]:
+                    print("{} - {}: no tract.".format(k, stops[k]['stop_name']))
+                report['unresolved'].append(k)
+                # kept with empty tract, so that it is not geocoded again unless it moves
+                tract = ""
+
+            mfp.write("{},{},{},{}\n".format(k, tract, stops[k]['latitude'], stops[k]['longitude']))
 
         mfp.close()
 
-    return
+    mtime, size, sha1 = file_signature(tract_file, digest=True)
+    with open(sig_file, "w+") as f:
+        f.write("{} {} {}\n".format(mtime, size, sha1))
+        f.close()
+
+    print("Stops added: {}, changed: {}, removed: {}, geocoded: {}, without tract: {}.".format(
+        len(report['added']), len(report['changed']), len(report['removed']), int(np.sum(todo)), len(report['unresolved'])))
+
+    return report
 
 
 
@@ -74,7 +240,7 @@ def main(argv):
     tract_file = "ba_census_tracts.tsv"
     map_file = "stop2tract.csv"
 
-    make_stop2tract(stop_files, tract_file, map_file)
+    make_stop2tract(stop_files, tract_file, map_file, incremental=True, workers=os.cpu_count())
 
     return
 
@@ -19,11 +19,14 @@ API:
 
 import sys
 import logging
+import hashlib
+import pickle
+import posixpath
 import numpy as np
-import scipy.ndimage as ndimage
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
 import shapefile as shp
 from kml_routines import KML
+from kml_styles import write_styles, style_ids
 
 
 
@@ -61,6 +64,290 @@ def make_zone_binary_matrix(cluster, dims):
 
 
 
+def make_zone_submatrix(cluster):
+    '''
+    Make a binary matrix with a zone indicated by 1s, cropped to the zone's bounding box.
+
+    :param cluster:
+        A set of (i, j) tuples indicating matrix elements belonging to the zone.
+
+    :returns:
+        Tuple (matrix, (i0, j0)), where matrix is a boolean numpy array and
+        (i0, j0) is the position of its upper left element in the full matrix.
+    '''
+
+    if len(cluster) < 1:
+        return np.zeros((0, 0), dtype=bool), (0, 0)
+
+    cells = np.array(list(cluster), dtype=np.int64).reshape(-1, 2)
+    i0, j0 = cells.min(axis=0)
+    i1, j1 = cells.max(axis=0)
+
+    matrix = np.zeros((i1 - i0 + 1, j1 - j0 + 1), dtype=bool)
+    matrix[cells[:, 0] - i0, cells[:, 1] - j0] = True
+
+    return matrix, (int(i0), int(j0))
+
+
+
+def get_zone_submatrix(args):
+    '''
+    Get the cropped binary matrix of a zone from args['matrix'] and args['offset'] if given,
+    or from args['cluster'] otherwise; see make_zone_submatrix().
+    '''
+
+    if 'matrix' in args.keys():
+        return args['matrix'], args['offset']
+
+    return make_zone_submatrix(args['cluster'])
+
+
+
+def make_zone_label_matrix(cell_sets, dims):
+    '''
+    Make a matrix where cells of the k-th set are labeled with k+1 and other cells with 0.
+    Sets must be disjoint.
+
+    :param cell_sets:
+        List of sets of (i, j) tuples.
+    :param dims:
+        A tuple (M, N) specifying matrix dimensions.
+
+    :returns:
+        M-by-N numpy array of integers, or None if the sets overlap.
+    '''
+
+    labels = np.zeros(dims, dtype=np.int32)
+
+    for k, cells in enumerate(cell_sets):
+        if len(cells) < 1:
+            continue
+        cells = np.array(list(cells), dtype=np.int64).reshape(-1, 2)
+        if np.any(labels[cells[:, 0], cells[:, 1]] != 0):
+            return None
+        labels[cells[:, 0], cells[:, 1]] = k + 1
+
+    return labels
+
+
+
+# zone geometry computed so far, keyed by zone_cache_key()
+geometry_cache = dict()
+
+# number of entries kept in geometry_cache beyond those of the zones being exported
+GEOMETRY_CACHE_SIZE = 10000
+
+# state of a zone decomposition worker process, see init_zone_worker()
+zone_worker = dict()
+
+
+def zone_cache_key(cells, args, geometry):
+    '''
+    Key of zone geometry in the cache: hash of the zone's cell set and the grid parameters.
+
+    :param cells:
+        Set of (i, j) tuples.
+    :param args:
+        Dictionary with grid parameters, same as for make_geo_boxes() without args['cluster'].
+    :param geometry:
+        Kind of geometry: 'outline' or 'boxes'.
+
+    :returns:
+        Hex digest string.
+    '''
+
+    c = np.array(list(cells), dtype=np.int64).reshape(-1, 2)
+    c = c[np.lexsort((c[:, 1], c[:, 0]))]
+
+    h = hashlib.sha1(c.tobytes())
+    grid = (tuple(args['bounding_box']), tuple(args['dims']), args['londeg_per_dx'], args['latdeg_per_dy'], geometry)
+    h.update(repr(grid).encode('utf-8'))
+
+    return h.hexdigest()
+
+
+
+def load_geometry_cache(cache_file):
+    '''
+    Add zone geometry saved by save_geometry_cache() to the in-memory cache.
+
+    :param cache_file:
+        Path to the cache file; nothing is loaded if it does not exist.
+    '''
+
+    if not posixpath.isfile(cache_file):
+        return
+
+    try:
+        with open(cache_file, 'rb') as f:
+            geometry_cache.update(pickle.load(f))
+            f.close()
+    except (IOError, pickle.UnpicklingError, EOFError) as err:
+        logging.warning("geodata_export.load_geometry_cache(): Cannot load cache \"{}\": {}.".format(cache_file, err))
+
+    return
+
+
+
+def save_geometry_cache(cache_file):
+    '''
+    Save the in-memory zone geometry cache to a file.
+
+    :param cache_file:
+        Path to the cache file.
+    '''
+
+    try:
+        with open(cache_file, 'wb') as f:
+            pickle.dump(geometry_cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.close()
+    except IOError as err:
+        logging.warning("geodata_export.save_geometry_cache(): Cannot save cache \"{}\": {}.".format(cache_file, err))
+
+    return
+
+
+
+def init_zone_worker(labels, args, geometry):
+    '''
+    Initialize zone decomposition worker process: the label matrix is received
+    once per worker, and zone bounding boxes are found once.
+    '''
+
+    import scipy.ndimage as ndimage
+
+    zone_worker['labels'] = labels
+    zone_worker['slices'] = ndimage.find_objects(labels)
+    zone_worker['args'] = args
+    zone_worker['geometry'] = geometry
+
+    return
+
+
+
+def decompose_zone_worker(k):
+    '''
+    Decompose k-th zone of the worker's label matrix.
+    '''
+
+    slices = zone_worker['slices']
+    args = dict(zone_worker['args'])
+
+    if k >= len(slices) or slices[k] == None:
+        args['matrix'], args['offset'] = np.zeros((0, 0), dtype=bool), (0, 0)
+    else:
+        s = slices[k]
+        args['matrix'] = zone_worker['labels'][s] == k + 1
+        args['offset'] = (s[0].start, s[1].start)
+
+    return make_zone_geometry(args, zone_worker['geometry'])
+
+
+
+def decompose_zones(cell_sets, args, geometry='outline', workers=1):
+    '''
+    Compute geometry of every zone, in order, optionally in a pool of processes.
+    Zones found in the geometry cache are not computed again, and computed ones are added to it;
+    zones with identical cells are computed once. The cache keeps at most GEOMETRY_CACHE_SIZE
+    entries of zones other than the given ones.
+
+    :param cell_sets:
+        List of sets of (i, j) tuples, one per zone.
+    :param args:
+        Dictionary with grid parameters, same as for make_geo_boxes() without args['cluster'].
+    :param geometry:
+        'outline' or 'boxes', see make_zone_geometry().
+    :param workers:
+        Number of worker processes. With more than one, the zones are encoded into a label matrix
+        that every worker receives once, and results are streamed back in zone order.
+        Zones that overlap cannot be encoded that way and are decomposed sequentially.
+
+    :returns:
+        Generator of make_zone_geometry() results, one per zone.
+    '''
+
+    keys = [zone_cache_key(cells, args, geometry) for cells in cell_sets]
+
+    # evict the oldest entries of other zones
+    if len(geometry_cache) > GEOMETRY_CACHE_SIZE:
+        current = set(keys)
+        stale = [key for key in geometry_cache.keys() if key not in current]
+        for key in stale[0:len(geometry_cache) - GEOMETRY_CACHE_SIZE]:
+            del geometry_cache[key]
+
+    # first zone of every missing key; zones with equal keys share one result
+    misses, seen = [], set()
+    for k in range(len(cell_sets)):
+        if keys[k] not in geometry_cache and keys[k] not in seen:
+            misses.append(k)
+            seen.add(keys[k])
+
+    labels = None
+    if workers > 1 and len(misses) > 1:
+        labels = make_zone_label_matrix([cell_sets[k] for k in misses], args['dims'])
+        if labels is None:
+            logging.warning("geodata_export.decompose_zones(): Zones overlap, decomposing them sequentially.")
+
+    if labels is None:
+        for k, cells in enumerate(cell_sets):
+            if keys[k] not in geometry_cache:
+                a = dict(args)
+                a['cluster'] = cells
+                geometry_cache[keys[k]] = make_zone_geometry(a, geometry)
+            yield geometry_cache[keys[k]]
+        return
+
+    chunksize = max(1, len(misses) // (8 * workers))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_zone_worker, initargs=(labels, args, geometry)) as ex:
+        results = ex.map(decompose_zone_worker, range(len(misses)), chunksize=chunksize)
+        for k in range(len(cell_sets)):
+            # results come in the order of misses, i.e. of the first zone with each key
+            if keys[k] not in geometry_cache:
+                geometry_cache[keys[k]] = next(results)
+            yield geometry_cache[keys[k]]
+
+    return
+
+
+
+def make_rectangles(matrix):
+    '''
+    Decompose a binary matrix into rectangles in one pass over its rows.
+    Every row is split into runs of 1s; a run identical to a run in the previous row
+    extends the rectangle started there, otherwise the rectangle is closed.
+
+    :param matrix:
+        M-by-N numpy array of zeros and ones.
+
+    :returns:
+        List of (i0, j0, i1, j1) tuples of inclusive row and column bounds.
+    '''
+
+    m = matrix.shape[0]
+    n = matrix.shape[1] if matrix.ndim > 1 else 0
+    rects = []
+    open_runs = dict()
+    empty = np.zeros(n, dtype=np.int8)
+
+    for i in range(m + 1):
+        row = matrix[i].astype(np.int8) if i < m else empty
+        d = np.diff(np.concatenate(([0], row, [0])))
+        runs = set(zip(np.flatnonzero(d > 0).tolist(), np.flatnonzero(d < 0).tolist()))
+
+        for run in sorted(open_runs.keys()):
+            if run not in runs:
+                rects.append((open_runs[run], run[0], i - 1, run[1] - 1))
+                del open_runs[run]
+
+        for run in runs:
+            if run not in open_runs:
+                open_runs[run] = i
+
+    return rects
+
+
+
 def make_geo_boxes(args):
     '''
     Generate a list of geo boxes defining the zone.
@@ -73,56 +360,24 @@ def make_geo_boxes(args):
             args['londeg_per_dx'] = Number of longitude degrees in the segment of length dx.
             args['latdeg_per_dy'] = Number of latitude degrees in the segment of length dy.
             args['cluster'] = Set of (i, j) tuples.
+            args['matrix'], args['offset'] = (Optional) Instead of args['cluster'], the zone as a binary matrix
+                                             and the (i, j) position of its upper left element.
 
     :returns geo_boxes:
         List of [min_lon, min_lat, max_lon, max_lat]-type lists, each defining a geo box.
     '''
 
     bb = args['bounding_box']
-    dims = args['dims']
     min_lon, min_lat = bb[0], bb[1]
     londeg_per_dx = args['londeg_per_dx']
     latdeg_per_dy = args['latdeg_per_dy']
-    cluster = args['cluster']
-    matrix = make_zone_binary_matrix(cluster, dims)
-    m, n = dims[0], dims[1]
-    non_zero = True
+    matrix, offset = get_zone_submatrix(args)
 
     geo_boxes = []
 
-    while non_zero:
-        idx = np.where(matrix > 0)
-        non_zero = len(idx[0]) > 0
-        if not non_zero:
-            continue
-
-        i0, j0 = idx[0][0], idx[1][0]
-        i, j = i0, j0
-        while (i < m) and (matrix[i, j0] > 0):
-            i += 1
-        while (j < n) and (matrix[i0, j] > 0):
-            j += 1
-        i1, j1 = i-1, j-1
-
-        i_a, j_a = i1, j1
-        i_b, j_b = i1, j1
-
-        submatrix = matrix[i0:i1+1, j0:j1+1]
-        idx_a = np.where(submatrix < 1)
-        if len(idx_a[0]) > 0:
-            i_a, j_a = i0 + idx_a[0][0], j0 + idx_a[1][0]
-        idx_b = np.where(np.transpose(submatrix) < 1)
-        if len(idx_b[0]) > 0:
-            i_b, j_b = i0 + idx_b[1][0], j0 + idx_b[0][0]
-
-        if (i_a - i0 + 1) * (j_a - j0 + 1) >= (i_b - i0 + 1) * (j_b - j0 + 1):
-            i1, j1 = i_a, j_a
-        else:
-            i1, j1 = i_b, j_b
-
-        for i in range(i0, i1+1):
-            for j in range(j0, j1+1):
-                matrix[i, j] = 0
+    for i0, j0, i1, j1 in make_rectangles(matrix):
+        i0, i1 = i0 + offset[0], i1 + offset[0]
+        j0, j1 = j0 + offset[1], j1 + offset[1]
 
         mn_lon = min_lon + j0 * londeg_per_dx
         mn_lat = min_lat + i0 * latdeg_per_dy
@@ -135,6 +390,211 @@ def make_geo_boxes(args):
 
 
 
+def split_ring(ring):
+    '''
+    Split a closed path (without the repeated first vertex) that visits some vertices
+    more than once into simple loops.
+
+    :param ring:
+        List of vertices.
+
+    :returns:
+        List of lists of vertices.
+    '''
+
+    loops = []
+    path = []
+    pos = dict()
+
+    for v in ring + [ring[0]]:
+        if v in pos:
+            k = pos[v]
+            loop = path[k:]
+            for u in loop:
+                del pos[u]
+            path = path[:k]
+            if len(loop) > 0:
+                loops.append(loop)
+        pos[v] = len(path)
+        path.append(v)
+
+    return loops
+
+
+
+def make_rings(matrix):
+    '''
+    Trace the boundary of every 4-connected component of a binary matrix.
+    Boundary edges are directed so that the zone is on their left, and chained
+    turning left first at vertices shared by diagonal cells, so that the outer ring
+    of a component is counterclockwise and its holes are clockwise.
+    Only vertices where the boundary turns are kept.
+
+    :param matrix:
+        M-by-N numpy array of zeros and ones.
+
+    :returns:
+        List of (outer, holes) tuples, one per component, where outer is a closed list
+        of (i, j) matrix corner positions and holes is a list of such lists.
+    '''
+
+    import scipy.ndimage as ndimage
+
+    matrix = np.asarray(matrix) > 0
+    if matrix.size < 1 or not np.any(matrix):
+        return []
+
+    labels, num = ndimage.label(matrix)
+    p = np.pad(matrix, 1)
+    inner = p[1:-1, 1:-1]
+
+    # direction d: 0 - east, 1 - north, 2 - west, 3 - south (j is east, i is north);
+    # edge of cell (i, j) goes from corner (i + si, j + sj) one step in direction d
+    sides = [(~p[:-2, 1:-1], 0, 0, 0), (~p[1:-1, 2:], 0, 1, 1), (~p[2:, 1:-1], 1, 1, 2), (~p[1:-1, :-2], 1, 0, 3)]
+    steps = [(0, 1), (1, 0), (0, -1), (-1, 0)]
+
+    out = dict()
+    edges = []
+    for empty, si, sj, d in sides:
+        ci, cj = np.nonzero(inner & empty)
+        for i, j in zip(ci.tolist(), cj.tolist()):
+            out[(i + si, j + sj, d)] = len(edges)
+            edges.append((i + si, j + sj, d, labels[i, j]))
+
+    used = np.zeros(len(edges), dtype=bool)
+    outers = dict()
+    holes = dict()
+
+    for e in range(len(edges)):
+        if used[e]:
+            continue
+
+        ring = []
+        cur = e
+        while not used[cur]:
+            used[cur] = True
+            i, j, d, lbl = edges[cur]
+            i, j = i + steps[d][0], j + steps[d][1]
+            for nd in [(d + 1) % 4, d, (d + 3) % 4]:
+                nxt = out.get((i, j, nd))
+                if nxt != None and (not used[nxt] or nxt == e):
+                    break
+            if nd != d:
+                ring.append((i, j))
+            cur = nxt
+
+        # a ring passing a corner twice is split there: the loop cut off is clockwise,
+        # i.e. a hole touching the outer ring at that corner
+        lbl = edges[e][3]
+        for loop in split_ring(ring):
+            loop.append(loop[0])
+            ii = np.array([v[0] for v in loop], dtype=float)
+            jj = np.array([v[1] for v in loop], dtype=float)
+            area = np.sum(jj[:-1] * ii[1:] - jj[1:] * ii[:-1])
+
+            if area > 0:
+                outers[lbl] = loop
+            else:
+                holes.setdefault(lbl, []).append(loop)
+
+    return [(outers[lbl], holes.get(lbl, [])) for lbl in sorted(outers.keys())]
+
+
+
+def make_geo_outlines(args):
+    '''
+    Generate polygon outlines of the zone: one polygon with holes per connected part.
+
+    :param args:
+        Dictionary with function arguments, same as for make_geo_boxes().
+
+    :returns geo_polygons:
+        List of (outer, holes) tuples, where outer is a closed counterclockwise list
+        of (lon, lat) tuples and holes is a list of closed clockwise lists of (lon, lat) tuples.
+    '''
+
+    bb = args['bounding_box']
+    min_lon, min_lat = bb[0], bb[1]
+    londeg_per_dx = args['londeg_per_dx']
+    latdeg_per_dy = args['latdeg_per_dy']
+    matrix, offset = get_zone_submatrix(args)
+
+    def to_geo(ring):
+        return [(min_lon + (j + offset[1]) * londeg_per_dx, min_lat + (i + offset[0]) * latdeg_per_dy) for i, j in ring]
+
+    return [(to_geo(outer), [to_geo(h) for h in hs]) for outer, hs in make_rings(matrix)]
+
+
+
+def make_zone_geometry(args, geometry='outline'):
+    '''
+    Generate zone geometry.
+
+    :param args:
+        Dictionary with function arguments, same as for make_geo_boxes().
+    :param geometry:
+        'outline' for make_geo_outlines() polygons, 'boxes' for make_geo_boxes() rectangles.
+
+    :returns:
+        Result of make_geo_outlines() or make_geo_boxes().
+    '''
+
+    if geometry == 'boxes':
+        return make_geo_boxes(args)
+
+    return make_geo_outlines(args)
+
+
+
+def make_kml_polygons(geom, geometry='outline', e=20):
+    '''
+    Convert zone geometry for KML.
+
+    :param geom:
+        Result of make_zone_geometry().
+    :param geometry:
+        Kind of geom: 'outline' or 'boxes'.
+    :param e:
+        Altitude.
+
+    :returns:
+        List of (outer_boundary, inner_boundaries) tuples of (lon, lat, e) tuples.
+    '''
+
+    if geometry == 'boxes':
+        return [([(p[0], p[1], e), (p[0], p[3], e), (p[2], p[3], e), (p[2], p[1], e)], None) for p in geom]
+
+    return [([(x, y, e) for x, y in outer], [[(x, y, e) for x, y in h] for h in holes])
+            for outer, holes in geom]
+
+
+
+def make_shapefile_parts(geom, geometry='outline'):
+    '''
+    Convert zone geometry for a shapefile record: outer rings clockwise, holes counterclockwise.
+
+    :param geom:
+        Result of make_zone_geometry().
+    :param geometry:
+        Kind of geom: 'outline' or 'boxes'.
+
+    :returns:
+        List of parts, each a list of [lon, lat] pairs.
+    '''
+
+    if geometry == 'boxes':
+        return [[[p[0], p[1]], [p[0], p[3]], [p[2], p[3]], [p[2], p[1]]] for p in geom]
+
+    parts = []
+    for outer, holes in geom:
+        parts.append([[x, y] for x, y in outer[::-1]])
+        for h in holes:
+            parts.append([[x, y] for x, y in h[::-1]])
+
+    return parts
+
+
+
 
 
 #==============================================================================
@@ -155,16 +615,13 @@ def stop_passengers_kml(kmlfile, stops, key='metric'):
     '''
 
     data = stops['data']
-    max = 0
-    for r in data:
-        max = np.max([max, r[key]])
+    values = np.array([r[key] for r in data], dtype=float)
     max = 20000
     print(max)
     dist = 150.0
 
     num_colors = 10
-    cmap = plt.cm.get_cmap('jet')
-    c = 255
+    styles = style_ids(values, 0, max, num_colors)
     e = 1
 
     rlat = 37.88 * np.pi / 180
@@ -183,16 +640,12 @@ def stop_passengers_kml(kmlfile, stops, key='metric'):
         return False
 
 
-    for i in range(int(num_colors) + 1):
-        style_id = "clr{}".format(i)
-        clr = cmap(float(i) / num_colors)
-        color = "FF{:02X}{:02X}{:02X}".format(int(c * clr[2]), int(c * clr[1]), int(c * clr[0]))
-        K.style(style_id, poly_color=color)
+    write_styles(K, num_colors, alpha="FF")
 
-    for r in data:
-        if r[key] < 2000:
+    for i, r in enumerate(data):
+        if values[i] < 2000:
             continue
-        style_id = "#clr{}".format(np.min([num_colors, int(np.round(float(r[key]) * num_colors / float(max)))]))
+        style_id = "#clr{}".format(styles[i])
         mn_lat, mn_lon = r['lat'] - dlat, r['lon'] - dlon
         mx_lat, mx_lon = r['lat'] + dlat, r['lon'] + dlon
 
@@ -215,7 +668,7 @@ def export_measurement_sequences_kml(args):
 
     :param args:
         Dictionary with function arguments:
-            args['kmlfile'] = Path to KML file that needs to be generated.
+            args['kmlfile'] = Path to KML file that needs to be generated; a .kmz path produces a zipped KMZ.
             args['data'] = List of lists of dictionaries, indexed by i.
                           Data are broken down to separate lists when the sequence of timestamps
                           is broken - when the time interval between two consecutive data points exceeds threshold.
@@ -247,8 +700,6 @@ def export_measurement_sequences_kml(args):
     if 'num_colors' in args.keys():
         num_colors = args['num_colors']
 
-    cmap = plt.cm.get_cmap('jet')
-    c = 255
     e = 1
 
     try:
@@ -260,27 +711,19 @@ def export_measurement_sequences_kml(args):
         logging.error("geodata_export.export_measurement_sequences_kml(): Cannot open KML file \"{}\": {}.".format(kmlfile, sys.exc_info()[0]))
         return False
 
-    for i in range(int(num_colors) + 1):
-        style_id = "clr{}".format(i)
-        clr = cmap(float(i) / num_colors)
-        color = "FF{:02X}{:02X}{:02X}".format(int(c * clr[2]), int(c * clr[1]), int(c * clr[0]))
-        K.style(style_id, poly_color=color)
+    write_styles(K, num_colors, alpha="FF")
 
 
     sz = len(data)
 
     for i in range(sz):
         s_sz = len(data[i])
+        styles = style_ids(np.arange(s_sz), 0, s_sz, num_colors)
         for j in range(s_sz):
-            style_id = "#clr{}".format(int(np.round(float(j) * num_colors / float(s_sz))))
-            geo = data[i][j]['geo']
-            p_sz = len(geo)
-            mn_lon, mx_lon = geo[0][0], geo[0][0]
-            mn_lat, mx_lat = geo[0][1], geo[0][1]
-            for k in range(p_sz):
-                lon, lat = geo[k][0], geo[k][1]
-                mn_lon, mx_lon = np.min([lon, mn_lon]), np.max([lon, mx_lon])
-                mn_lat, mx_lat = np.min([lat, mn_lat]), np.max([lat, mx_lat])
+            style_id = "#clr{}".format(styles[j])
+            geo = np.asarray(data[i][j]['geo'], dtype=float)
+            mn_lon, mn_lat = np.min(geo[:, 0]), np.min(geo[:, 1])
+            mx_lon, mx_lat = np.max(geo[:, 0]), np.max(geo[:, 1])
             name = "Datum {}/{}: {}".format(i, j, data[i][j]['time'])
             desc = "Time: {}\nDistance: {}\n".format(data[i][j]['time'], data[i][j]['distance'])
             poly = [(mn_lon, mn_lat, e), (mn_lon, mx_lat, e), (mx_lon, mx_lat, e), (mx_lon, mn_lat, e)]
@@ -298,7 +741,7 @@ def export_bounding_boxes_kml(args):
 
     :param args:
         Dictionary with function arguments:
-            args['kmlfile'] = Path to KML file that needs to be generated.
+            args['kmlfile'] = Path to KML file that needs to be generated; a .kmz path produces a zipped KMZ.
             args['bboxes'] = List of bounding boxes:
                 args['bboxes'][i]['bbox'] = [min_lon, min_lat, max_lon, max_lat].
                 args['bboxes'][i]['volume'] = area of the bounding box in meters.
@@ -318,8 +761,6 @@ def export_bounding_boxes_kml(args):
     data = args['bboxes']
     num_colors = len(data)
 
-    cmap = plt.cm.get_cmap('jet')
-    c = 255
     e = 1
 
     try:
@@ -331,11 +772,7 @@ def export_bounding_boxes_kml(args):
         logging.error("geodata_export.export_bounding_boxes_kml(): Cannot open KML file \"{}\": {}.".format(kmlfile, sys.exc_info()[0]))
         return False
 
-    for i in range(int(num_colors) + 1):
-        style_id = "clr{}".format(i)
-        clr = cmap(float(i) / num_colors)
-        color = "FF{:02X}{:02X}{:02X}".format(int(c * clr[2]), int(c * clr[1]), int(c * clr[0]))
-        K.style(style_id, poly_color=color)
+    write_styles(K, num_colors, alpha="FF")
 
 
     sz = len(data)
@@ -363,7 +800,7 @@ def export_kml(args):
     
     :param args:
         Dictionary with function arguments:
-            args['kmlfile'] = Path to KML file that needs to be generated.
+            args['kmlfile'] = Path to KML file that needs to be generated; a .kmz path produces a zipped KMZ.
             args['zoning'] = Dictionary with zoning info:
                              args['zoning']['bounding_box'] = List [min_lon, min_lat, max_lon, max_lat], representing
                                                               geo bounding box for field data.
@@ -372,6 +809,10 @@ def export_kml(args):
                              args['zoning']['latdeg_per_dy'] = Number of latitude degrees in the segment of length dy.
                              args['zoning']['clusters'] = List of (i, j)-tuple sets, each set describing cells
                                                           that belong to the same class.
+            args['geometry'] = (Optional) 'outline' - one polygon with holes per connected part of a zone (default),
+                               'boxes' - the zone as a set of rectangles.
+            args['workers'] = (Optional) Number of processes decomposing zones. Default = 1.
+            args['cache_file'] = (Optional) File where zone geometry is cached between runs and exports.
             
     :returns res:
         True if operation was successful, False - otherwise.
@@ -384,6 +825,8 @@ def export_kml(args):
         return False
     
     kmlfile = args['kmlfile']
+    geometry = args.get('geometry', 'outline')
+    workers = args.get('workers', 1)
     zoning = args['zoning']
     bb = zoning['bounding_box']
     min_lon, min_lat = bb[0], bb[1]
@@ -392,8 +835,6 @@ def export_kml(args):
     d_lon, d_lat = bb[2] - bb[0], bb[3] - bb[1]
     londeg_per_dx, latdeg_per_dy = d_lon / float(dims[1]), d_lat / float(dims[0])
     
-    cmap = plt.cm.get_cmap('jet')
-    c = 255
     e = 20
     
     num_zones = len(clusters)
@@ -407,11 +848,7 @@ def export_kml(args):
         logging.error("geodata_export.export_kml(): Cannot open KML file \"{}\": {}.".format(kmlfile, sys.exc_info()[0]))
         return False
     
-    for i in range(int(num_zones)+1):
-        style_id = "clr{}".format(i)
-        clr = cmap(float(i)/num_zones)
-        color = "FF{:02X}{:02X}{:02X}".format(int(c*clr[2]), int(c*clr[1]), int(c*clr[0]))
-        K.style(style_id, poly_color=color)
+    write_styles(K, num_zones, alpha="FF")
 
     args2 = {'bounding_box': bb, 'dims': dims, 'londeg_per_dx': londeg_per_dx, 'latdeg_per_dy': latdeg_per_dy}
 
@@ -419,9 +856,11 @@ def export_kml(args):
     if 'meta' in args['zoning']:
         meta = args['zoning']['meta']
 
-    sz = len(clusters)
-    for k in range(sz):
-        cl = clusters[k]
+    if 'cache_file' in args.keys():
+        load_geometry_cache(args['cache_file'])
+
+    for k, geom in enumerate(decompose_zones(clusters, args2, geometry, workers)):
+        polys = make_kml_polygons(geom, geometry, e)
 
         p_stats = dict()
         if meta != None:
@@ -429,27 +868,28 @@ def export_kml(args):
 
         logging.debug("geodata_export.export_kml(): Exporting zone {} to KML file \"{}\"...".format(k, kmlfile))
 
-        args2['cluster'] = cl
-        polys = make_geo_boxes(args2)
+        if len(polys) < 1:
+            continue
 
-        for p in polys:
-            name = "Zone {}".format(k)
-            style_id = "#clr{}".format(k)
+        name = "Zone {}".format(k)
+        style_id = "#clr{}".format(k)
 
-            desc = "<![CDATA["
-            for ps in p_stats.keys():
-                s = p_stats[ps]
-                desc += "<b>{}:</b><br>".format(ps)
-                desc += "min = {:.4f}<br>".format(s['min'])
-                desc += "max = {:.4f}<br>".format(s['max'])
-                desc += "mean = {:.4f}<br>".format(s['mean'])
-                desc += "<p>"
-            desc += "]]>"
-                               
-            poly = [(p[0], p[1], e), (p[0], p[3], e), (p[2], p[3], e), (p[2], p[1], e)]
-            K.polygon(poly, name=name, description=desc, style=style_id)
+        desc = "<![CDATA["
+        for ps in p_stats.keys():
+            s = p_stats[ps]
+            desc += "<b>{}:</b><br>".format(ps)
+            desc += "min = {:.4f}<br>".format(s['min'])
+            desc += "max = {:.4f}<br>".format(s['max'])
+            desc += "mean = {:.4f}<br>".format(s['mean'])
+            desc += "<p>"
+        desc += "]]>"
+
+        K.multi_polygon(polys, name=name, description=desc, style=style_id)
             
     K.close()
+
+    if 'cache_file' in args.keys():
+        save_geometry_cache(args['cache_file'])
     
     return True
 
@@ -461,7 +901,7 @@ def export_areas_to_kml(args):
 
     :param args:
         Dictionary with function arguments:
-            args['kmlfile'] = Path to KML file that needs to be generated.
+            args['kmlfile'] = Path to KML file that needs to be generated; a .kmz path produces a zipped KMZ.
             args['zoning'] = Dictionary with zoning info:
                              args['zoning']['bounding_box'] = List [min_lon, min_lat, max_lon, max_lat], representing
                                                               geo bounding box for field data.
@@ -475,6 +915,10 @@ def export_areas_to_kml(args):
                                                         args['zoning']['areas'][i]['zone'] = Zone ID.
                                                         args['zoning']['areas'][i]['area_set'] = Set of (i, j)-tuples addressing matrix cells.
                                                         args['zoning']['areas'][i]['border_areas'] = Set of area IDs surrounding our area.
+            args['geometry'] = (Optional) 'outline' - one polygon with holes per connected part of a zone (default),
+                               'boxes' - the zone as a set of rectangles.
+            args['workers'] = (Optional) Number of processes decomposing zones. Default = 1.
+            args['cache_file'] = (Optional) File where zone geometry is cached between runs and exports.
 
     :returns res:
         True if operation was successful, False - otherwise.
@@ -487,6 +931,8 @@ def export_areas_to_kml(args):
         return False
 
     kmlfile = args['kmlfile']
+    geometry = args.get('geometry', 'outline')
+    workers = args.get('workers', 1)
     zoning = args['zoning']
     bb = zoning['bounding_box']
     min_lon, min_lat = bb[0], bb[1]
@@ -496,8 +942,6 @@ def export_areas_to_kml(args):
     d_lon, d_lat = bb[2] - bb[0], bb[3] - bb[1]
     londeg_per_dx, latdeg_per_dy = d_lon / float(dims[1]), d_lat / float(dims[0])
 
-    cmap = plt.cm.get_cmap('jet')
-    c = 255
     e = 20
 
     num_zones = len(clusters)
@@ -512,32 +956,34 @@ def export_areas_to_kml(args):
             "geodata_export.export_kml(): Cannot open KML file \"{}\": {}.".format(kmlfile, sys.exc_info()[0]))
         return False
 
-    for i in range(int(num_zones) + 1):
-        style_id = "clr{}".format(i)
-        clr = cmap(float(i) / num_zones)
-        color = "FF{:02X}{:02X}{:02X}".format(int(c * clr[2]), int(c * clr[1]), int(c * clr[0]))
-        K.style(style_id, poly_color=color)
+    write_styles(K, num_zones, alpha="FF")
 
     args2 = {'bounding_box': bb, 'dims': dims, 'londeg_per_dx': londeg_per_dx, 'latdeg_per_dy': latdeg_per_dy}
 
-    for a in areas:
+    if 'cache_file' in args.keys():
+        load_geometry_cache(args['cache_file'])
+
+    area_sets = [a['area_set'] for a in areas]
+
+    for a, geom in zip(areas, decompose_zones(area_sets, args2, geometry, workers)):
+        polys = make_kml_polygons(geom, geometry, e)
+
         logging.debug("geodata_export.export_kml(): Exporting area {} to KML file \"{}\"...".format(a['id'], kmlfile))
 
-        args2['cluster'] = a['area_set']
-        #if a['id'] != 647 and a['id'] != 97:
-         #   continue
-        polys = make_geo_boxes(args2)
+        if len(polys) < 1:
+            continue
 
-        for p in polys:
-            name = "Area {}".format(a['id'])
-            style_id = "#clr{}".format(int(a['zone']))
-            desc = "Area: {}\nZone: {}\nVolume: {}\nBorder Areas: {}\nBorder Cell Counts by Zone: {}".format(a['id'], a['zone'], len(a['area_set']), a['border_areas'], a['border_zone_counts'])
+        name = "Area {}".format(a['id'])
+        style_id = "#clr{}".format(int(a['zone']))
+        desc = "Area: {}\nZone: {}\nVolume: {}\nBorder Areas: {}\nBorder Cell Counts by Zone: {}".format(a['id'], a['zone'], len(a['area_set']), a['border_areas'], a['border_zone_counts'])
 
-            poly = [(p[0], p[1], e), (p[0], p[3], e), (p[2], p[3], e), (p[2], p[1], e)]
-            K.polygon(poly, name=name, description=desc, style=style_id)
+        K.multi_polygon(polys, name=name, description=desc, style=style_id)
 
     K.close()
 
+    if 'cache_file' in args.keys():
+        save_geometry_cache(args['cache_file'])
+
     return True
 
 
@@ -557,6 +1003,10 @@ def export_shapefile(args):
                              args['zoning']['latdeg_per_dy'] = Number of latitude degrees in the segment of length dy.
                              args['zoning']['clusters'] = Updated list of (i, j)-tuple sets, each set describing cells
                                                           that belong to the same class.
+            args['geometry'] = (Optional) 'outline' - one polygon with holes per connected part of a zone (default),
+                               'boxes' - the zone as a set of rectangles.
+            args['workers'] = (Optional) Number of processes decomposing zones. Default = 1.
+            args['cache_file'] = (Optional) File where zone geometry is cached between runs and exports.
             
     :returns res:
         True if operation was successful, False - otherwise.
@@ -569,6 +1019,8 @@ def export_shapefile(args):
         return False
     
     shpfile = args['shapefile']
+    geometry = args.get('geometry', 'outline')
+    workers = args.get('workers', 1)
     zoning = args['zoning']
     bb = zoning['bounding_box']
     min_lon, min_lat = bb[0], bb[1]
@@ -593,9 +1045,11 @@ def export_shapefile(args):
 
     args2 = {'bounding_box': bb, 'dims': dims, 'londeg_per_dx': londeg_per_dx, 'latdeg_per_dy': latdeg_per_dy}
 
-    sz = len(clusters)
-    for k in range(sz):
-        cl = clusters[k]
+    if 'cache_file' in args.keys():
+        load_geometry_cache(args['cache_file'])
+
+    for k, geom in enumerate(decompose_zones(clusters, args2, geometry, workers)):
+        parts = make_shapefile_parts(geom, geometry)
 
         p_stats = dict()
         if meta != None:
@@ -603,15 +1057,6 @@ def export_shapefile(args):
 
         logging.debug("geodata_export.export_shapefile(): Exporting zone {} to shapefile \"{}\"...".format(k, shpfile))
 
-        args2['cluster'] = cl
-        polys = make_geo_boxes(args2)
-
-        parts = []
-        for p in polys:
-            name = "Zone {} ({})".format(k, p)
-            poly = [[p[0], p[1]], [p[0], p[3]], [p[2], p[3]], [p[2], p[1]]]
-            parts.append(poly)
-
         if len(parts) > 0:
             w.poly(parts=parts)
             rlist = [k]
@@ -624,6 +1069,9 @@ def export_shapefile(args):
             w.record(*tuple(rlist))
 
     w.save(shpfile)
+
+    if 'cache_file' in args.keys():
+        save_geometry_cache(args['cache_file'])
     
     return
 
@@ -643,8 +1091,7 @@ def main(argv):
     args['kmlfile'] = "data/zoning.kml"
     args['shapefile'] = "data/zoning.shp"
     args['debug'] = True
-    
-    import pickle
+    args['cache_file'] = "data/zoning.geometry.pickle"
 
     f = open("data/zoning.pickle", 'rb')
     args['zoning'] = pickle.load(f)
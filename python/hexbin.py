@@ -0,0 +1,294 @@
+"""
+
+Hexagonal binning routines.
+
+Pointy-top hexagons on the local plane around the origin, with the same
+meters-per-degree conversion as BB. Hexagons are addressed by axial
+coordinates (q, r); all conversions work on whole arrays of points.
+
+"""
+
+
+import sys
+import logging
+import numpy as np
+import shapefile as shp
+import util
+from bbox import BB, reduce_by_id
+from kml_routines import KML, KMLChunks
+from kml_styles import write_styles, value_range, style_ids
+
+
+# offset making axial coordinates non-negative in flat hex IDs
+HEX_OFFSET = 1 << 20
+
+
+class HB:
+
+
+
+    def __init__(self, size=1000, o_lat=37.0, o_lon=-122.54):
+        '''
+        Constructor...
+
+        :param size: distance between centers of neighboring hexagons in meters.
+        :param o_lat: origin latitude.
+        :param o_lon: origin longitude.
+        '''
+
+        self.size = size
+        self.o_lat = o_lat
+        self.o_lon = o_lon
+
+        # degrees per meter at the origin
+        self.bb = BB(dx=1, dy=1, o_lat=o_lat, o_lon=o_lon)
+
+        # circumradius
+        self.radius = size / np.sqrt(3)
+
+        return
+
+
+
+    def hex_addresses(self, lats, lons):
+        '''
+        Get axial coordinates of the hexagons containing given geo locations.
+
+        :param lats: array of latitudes.
+        :param lons: array of longitudes.
+
+        :return: Tuple (q, r) of integer arrays.
+        '''
+
+        x = (np.asarray(lons, dtype=float) - self.o_lon) / self.bb.dlon
+        y = (np.asarray(lats, dtype=float) - self.o_lat) / self.bb.dlat
+
+        # fractional cube coordinates
+        fq = (np.sqrt(3) / 3 * x - y / 3) / self.radius
+        fr = (2.0 / 3 * y) / self.radius
+        fs = -fq - fr
+
+        q, r, s = np.round(fq), np.round(fr), np.round(fs)
+        dq, dr, ds = np.abs(q - fq), np.abs(r - fr), np.abs(s - fs)
+
+        fix_q = (dq > dr) & (dq > ds)
+        fix_r = ~fix_q & (dr > ds)
+        q = np.where(fix_q, -r - s, q)
+        r = np.where(fix_r, -q - s, r)
+
+        return (q.astype(np.int64), r.astype(np.int64))
+
+
+
+    def hex_ids(self, lats, lons):
+        '''
+        Flat hexagon IDs of the hexagons containing given geo locations, suitable for np.bincount().
+
+        :param lats: array of latitudes.
+        :param lons: array of longitudes.
+
+        :return: Integer array of hexagon IDs.
+        '''
+
+        q, r = self.hex_addresses(lats, lons)
+
+        return (q + HEX_OFFSET) * (2 * HEX_OFFSET) + (r + HEX_OFFSET)
+
+
+
+    def id2address(self, ids):
+        '''
+        Convert flat hexagon IDs back to axial coordinates.
+
+        :param ids: array of hexagon IDs.
+
+        :return: Tuple (q, r) of integer arrays.
+        '''
+
+        q, r = np.divmod(np.asarray(ids, dtype=np.int64), 2 * HEX_OFFSET)
+
+        return (q - HEX_OFFSET, r - HEX_OFFSET)
+
+
+
+    def hex_centers(self, q, r):
+        '''
+        Compute centers of hexagons.
+
+        :param q: array of axial q coordinates.
+        :param r: array of axial r coordinates.
+
+        :return: Tuple (lats, lons) of arrays.
+        '''
+
+        q, r = np.asarray(q, dtype=float), np.asarray(r, dtype=float)
+        x = self.radius * np.sqrt(3) * (q + r / 2)
+        y = self.radius * 1.5 * r
+
+        return (self.o_lat + y * self.bb.dlat, self.o_lon + x * self.bb.dlon)
+
+
+
+    def hex_boundaries(self, q, r):
+        '''
+        Compute boundaries of hexagons.
+
+        :param q: array of axial q coordinates.
+        :param r: array of axial r coordinates.
+
+        :return: Array of shape (N, 6, 2) with [lon, lat] vertices, counterclockwise.
+        '''
+
+        lats, lons = self.hex_centers(q, r)
+        angles = np.pi / 180 * (30 + 60 * np.arange(6))
+        dlon = self.radius * np.cos(angles) * self.bb.dlon
+        dlat = self.radius * np.sin(angles) * self.bb.dlat
+
+        vertices = np.empty((len(lats), 6, 2))
+        vertices[:, :, 0] = lons[:, np.newaxis] + dlon
+        vertices[:, :, 1] = lats[:, np.newaxis] + dlat
+
+        return vertices
+
+
+
+    def aggregate(self, lats, lons, on, off, load):
+        '''
+        Aggregate stop level passenger counts into hexagons.
+
+        :param lats: array of stop latitudes.
+        :param lons: array of stop longitudes.
+        :param on: array of boarding counts.
+        :param off: array of alighting counts.
+        :param load: array of passenger loads.
+
+        :return: Struct of arrays, one entry per non-empty hexagon:
+                 {'q': ..., 'r': ..., 'on': ..., 'off': ..., 'load': ..., 'num_stops': ..., 'metric': ...},
+                 where metric is max(on, off) of the hexagon totals.
+        '''
+
+        hex_ids = self.hex_ids(lats, lons)
+        values = {'on': on, 'off': off, 'load': load, 'num_stops': np.ones(len(hex_ids), dtype=np.int64)}
+        ids, sums = reduce_by_id(hex_ids, values)
+        q, r = self.id2address(ids)
+
+        hexes = {'q': q, 'r': r}
+        hexes.update(sums)
+        hexes['metric'] = np.maximum(hexes['on'], hexes['off'])
+
+        return hexes
+
+
+
+    def make_shapefile(self, hexes, shpfile):
+        '''
+        Create shapefile with hexagons with some attributes.
+
+        :param hexes: struct of arrays returned by aggregate().
+        :param shpfile: path to the shapefile to be generated.
+        '''
+
+        w = shp.Writer(shp.POLYGON)
+        w.field('Hex Address', 'C', 32)
+        attrs = [a for a in hexes.keys() if a not in ['q', 'r']]
+        for a in attrs:
+            w.field(a, 'C', 32)
+
+        q, r = np.asarray(hexes['q']), np.asarray(hexes['r'])
+        vertices = self.hex_boundaries(q, r)
+        columns = [np.asarray(hexes[a]).tolist() for a in attrs]
+
+        for i in range(len(q)):
+            # shapefile outer rings are clockwise
+            ring = vertices[i][::-1].tolist()
+            w.poly(parts=[ring + [ring[0]]])
+
+            rlist = ["({}, {})".format(q[i], r[i])]
+            for c in columns:
+                rlist.append(c[i])
+
+            w.record(*tuple(rlist))
+
+        w.save(shpfile)
+        util.make_wkt_projection(shpfile)
+
+        return
+
+
+
+    def make_kml(self, hexes, kmlfile, key='metric', num_colors=10, threshold=2000, max_placemarks=None):
+        '''
+        Create KML file with hexagons colored by a given attribute.
+
+        :param hexes: struct of arrays returned by aggregate().
+        :param kmlfile: path to the KML file to be generated; a .kmz path produces a zipped KMZ.
+        :param key: attribute used for coloring.
+        :param num_colors: number of colors.
+        :param threshold: hexagons with key below this value are skipped.
+        :param max_placemarks: if given, split the output into linked chunk files of this many hexagons, see KMLChunks.
+        '''
+
+        values = np.asarray(hexes[key], dtype=float)
+        min, max = value_range(values)
+        max = 0.5 * max
+        styles = style_ids(values, min, max, num_colors)
+
+        e = 1
+
+        try:
+            if max_placemarks == None:
+                K = KML(kmlfile)
+            else:
+                K = KMLChunks(kmlfile, max_placemarks)
+        except IOError as err:
+            logging.error("make_kml(): Cannot open KML file \"{}\": {}.".format(kmlfile, err.strerror))
+            return
+        except:
+            logging.error("make_kml(): Cannot open KML file \"{}\": {}.".format(kmlfile, sys.exc_info()[0]))
+            return
+
+        write_styles(K, num_colors, alpha="7F")
+
+        q, r = np.asarray(hexes['q']), np.asarray(hexes['r'])
+        vertices = self.hex_boundaries(q, r)
+        attrs = [a for a in hexes.keys() if a not in ['q', 'r']]
+        columns = [np.asarray(hexes[a]).tolist() for a in attrs]
+
+        for i in range(len(q)):
+            if values[i] < threshold:
+                continue
+
+            desc = ""
+            for a, col in zip(attrs, columns):
+                desc += "{}: {}\n".format(a, col[i])
+
+            poly = [(v[0], v[1], e) for v in vertices[i]]
+            K.polygon(poly, name="({}, {})".format(q[i], r[i]), description=desc, style="#clr{}".format(styles[i]))
+
+        K.close()
+
+        return
+
+
+
+
+
+
+
+
+
+#==============================================================================
+# Main function.
+#==============================================================================
+def main(argv):
+    print(__doc__)
+
+
+
+
+
+
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,130 @@
+"""
+
+Import-time benchmark.
+
+Imports every module in a fresh interpreter, reports the best time of several runs
+and checks that no heavy package (matplotlib, scipy, shapely, pandas) gets loaded at
+import time: these are imported inside the functions that need them.
+Exits with status 1 if a module exceeds its time budget or loads a heavy package.
+
+Usage:
+    python import_benchmark.py [<number of runs>]
+
+"""
+
+
+import sys
+import posixpath
+import subprocess
+
+
+# packages that must not be loaded just by importing a module
+HEAVY = ['matplotlib', 'scipy', 'shapely', 'pandas']
+
+# module name -> import time budget in milliseconds
+MODULES = {
+    'tsv2csv': 50,
+    'actransit_csv': 50,
+    'tridelta_csv': 50,
+    'censustracts_tsv': 50,
+    'util': 50,
+    'kml_routines': 50,
+    'kml_styles': 300,
+    'bbox': 300,
+    'hexbin': 300,
+    'crosswalk': 300,
+    'ctract': 300,
+    'generate_stop2tract': 300,
+    'geodata_export': 300,
+}
+
+PROBE = """
+import sys, time
+t = time.perf_counter()
+import {}
+dt = time.perf_counter() - t
+print(dt * 1000)
+print("heavy:" + ",".join([h for h in {} if h in sys.modules]))
+"""
+
+
+
+def time_import(module, runs=5):
+    '''
+    Measure import time of a module, each run in a new interpreter.
+
+    :param module: module name.
+    :param runs: number of runs.
+
+    :return: Tuple (best time in milliseconds, list of heavy packages loaded),
+             or (None, error message) if the import fails.
+    '''
+
+    cwd = posixpath.dirname(posixpath.abspath(__file__))
+    best, heavy = None, []
+
+    for r in range(runs):
+        res = subprocess.run([sys.executable, "-c", PROBE.format(module, HEAVY)], cwd=cwd,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if res.returncode != 0:
+            return (None, res.stderr.strip().split("\n")[-1])
+
+        lines = res.stdout.strip().split("\n")
+        dt = float(lines[-2])
+        heavy = [h for h in lines[-1][len("heavy:"):].split(",") if h != ""]
+        if best == None or dt < best:
+            best = dt
+
+    return (best, heavy)
+
+
+
+
+
+
+
+
+
+#==============================================================================
+# Main function.
+#==============================================================================
+def main(argv):
+    print(__doc__)
+
+    runs = 5
+    if len(argv) > 1:
+        runs = int(argv[1])
+
+    failed = []
+    for module in MODULES.keys():
+        dt, heavy = time_import(module, runs)
+        if dt == None:
+            print("{:24s} import failed: {}".format(module, heavy))
+            failed.append(module)
+            continue
+
+        status = "ok"
+        if dt > MODULES[module]:
+            status = "SLOW (budget {} ms)".format(MODULES[module])
+        if len(heavy) > 0:
+            status = "LOADS {}".format(", ".join(heavy))
+        if status != "ok":
+            failed.append(module)
+
+        print("{:24s} {:8.1f} ms   {}".format(module, dt, status))
+
+    if len(failed) > 0:
+        print("\nFailed: {}".format(", ".join(failed)))
+        return 1
+
+    return 0
+
+
+
+
+
+
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
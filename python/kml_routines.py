@@ -4,39 +4,95 @@ KML routines.
 
 
 import sys
+import io
+import posixpath
+import zipfile
+
+
+# name of the KML document inside a KMZ archive
+KMZ_DOC = "doc.kml"
 
 
 class KML:
     
-    def __init__(self, kml_file):
+    def __init__(self, kml_file, buffer_size=1048576, kmz=None):
         '''
         Constructor...
+
+        :param kml_file: path to the KML file to be generated.
+        :param buffer_size: number of bytes collected in memory before they are written out.
+        :param kmz: write a zipped KMZ archive instead of plain KML; by default,
+                    decided by the ".kmz" extension of kml_file.
         '''
         
         self.kml_file = kml_file
-        self.kml = open(self.kml_file, 'w')
+        self.buffer_size = buffer_size
+
+        if kmz == None:
+            kmz = posixpath.splitext(kml_file)[1].lower() == ".kmz"
+        self.kmz = kmz
+
+        if self.kmz:
+            self.zip = zipfile.ZipFile(self.kml_file, 'w', zipfile.ZIP_DEFLATED)
+            self.kml = self.zip.open(KMZ_DOC, 'w')
+        else:
+            self.zip = None
+            self.kml = io.BufferedWriter(io.FileIO(self.kml_file, 'w'), buffer_size=buffer_size)
+
+        # pending text, written out in one piece by flush()
+        self.buffer = []
+        self.buffered = 0
         
-        self.kml.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n")
-        self.kml.write("<kml xmlns=\"http://www.opengis.net/kml/2.2\">\n  <Document>\n")
+        self.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n")
+        self.write("<kml xmlns=\"http://www.opengis.net/kml/2.2\">\n  <Document>\n")
         
         return
 
 
 
+    def write(self, text):
+        '''
+        Add text to the output buffer, flushing it when full.
+        '''
+
+        self.buffer.append(text)
+        self.buffered += len(text)
+
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+        return
+
+
+
+    def flush(self):
+        '''
+        Write out the output buffer.
+        '''
+
+        if len(self.buffer) > 0:
+            self.kml.write("".join(self.buffer).encode("utf-8"))
+            self.buffer = []
+            self.buffered = 0
+
+        return
+
+
+
     def style(self, style_id, line_width=1, line_color="00000000", poly_color="00000000"):
         '''
         
         '''
         
-        self.kml.write("    <Style id=\"{}\">\n".format(style_id))
-        self.kml.write("     <LineStyle>\n")
-        self.kml.write("      <width>{}</width>\n".format(line_width))
-        self.kml.write("      <color>{}</color>\n".format(line_color))
-        self.kml.write("     </LineStyle>\n")
-        self.kml.write("     <PolyStyle>\n")
-        self.kml.write("      <color>{}</color>\n".format(poly_color))
-        self.kml.write("     </PolyStyle>\n")
-        self.kml.write("    </Style>\n")
+        self.write("    <Style id=\"{}\">\n"
+                   "     <LineStyle>\n"
+                   "      <width>{}</width>\n"
+                   "      <color>{}</color>\n"
+                   "     </LineStyle>\n"
+                   "     <PolyStyle>\n"
+                   "      <color>{}</color>\n"
+                   "     </PolyStyle>\n"
+                   "    </Style>\n".format(style_id, line_width, line_color, poly_color))
         
         return
         
@@ -47,41 +103,138 @@ class KML:
         
         '''
         
-        self.kml.write("    <Placemark>\n")
-        self.kml.write("      <name>{}</name>\n".format(name))
+        self.multi_polygon([(outer_boundary, inner_boundaries)], name=name, description=description, style=style)
         
-        if description != None:
-            self.kml.write("      <description>{}</description>\n".format(description))
-            
-        self.kml.write("      <styleUrl>{}</styleUrl>\n".format(style))
-        self.kml.write("      <Polygon>\n")
-        self.kml.write("        <extrude>1</extrude>\n")
-        self.kml.write("        <altitudeMode>relativeToGround</altitudeMode>\n")
-        self.kml.write("        <outerBoundaryIs>\n")
-        self.kml.write("          <LinearRing>\n")
-        self.kml.write("            <coordinates>\n")
+        return
+
+
+
+    def multi_polygon(self, polygons, name="Poly", description=None, style="clr1"):
+        '''
+        Write a placemark with one or more polygons.
+
+        :param polygons: list of (outer_boundary, inner_boundaries) tuples, where outer_boundary
+                         is a list of (lon, lat, altitude) tuples and inner_boundaries is None
+                         or a list of such lists.
+        '''
         
-        sz = len(outer_boundary)
-        for i in range(sz):
-            self.kml.write("              {},{},{}\n".format(outer_boundary[i][0], outer_boundary[i][1], outer_boundary[i][2]))
+        parts = ["    <Placemark>\n      <name>{}</name>\n".format(name)]
+        
+        if description != None:
+            parts.append("      <description>{}</description>\n".format(description))
             
-        self.kml.write("            </coordinates>\n")
-        self.kml.write("          </LinearRing>\n")
-        self.kml.write("        </outerBoundaryIs>\n")
-        self.kml.write("      </Polygon>\n")
-        self.kml.write("    </Placemark>\n")
+        parts.append("      <styleUrl>{}</styleUrl>\n".format(style))
+
+        multi = len(polygons) > 1
+        if multi:
+            parts.append("      <MultiGeometry>\n")
+
+        for outer_boundary, inner_boundaries in polygons:
+            parts.append("      <Polygon>\n"
+                         "        <extrude>1</extrude>\n"
+                         "        <altitudeMode>relativeToGround</altitudeMode>\n")
+            parts.append(self.linear_ring("outerBoundaryIs", outer_boundary))
+            if inner_boundaries != None:
+                for inner_boundary in inner_boundaries:
+                    parts.append(self.linear_ring("innerBoundaryIs", inner_boundary))
+            parts.append("      </Polygon>\n")
+
+        if multi:
+            parts.append("      </MultiGeometry>\n")
+
+        parts.append("    </Placemark>\n")
+
+        self.write("".join(parts))
         
         return
 
 
 
+    def linear_ring(self, tag, boundary):
+        '''
+        Format a boundary of a polygon.
+
+        :return: KML text of the boundary.
+        '''
+
+        coords = "".join(["              {},{},{}\n".format(p[0], p[1], p[2]) for p in boundary])
+
+        return ("        <{0}>\n"
+                "          <LinearRing>\n"
+                "            <coordinates>\n"
+                "{1}"
+                "            </coordinates>\n"
+                "          </LinearRing>\n"
+                "        </{0}>\n".format(tag, coords))
+
+
+
+    def stream(self, placemarks):
+        '''
+        Write placemarks one by one as they are produced, without holding them in memory.
+
+        :param placemarks: iterable (typically a generator) of dictionaries with multi_polygon()
+                           arguments: {'polygons': ..., 'name': ..., 'description': ..., 'style': ...}.
+
+        :return: Number of placemarks written.
+        '''
+
+        count = 0
+        for p in placemarks:
+            self.multi_polygon(**p)
+            count += 1
+
+        return count
+
+
+
+    def network_link(self, href, bounds, name="Link", min_lod_pixels=128, max_lod_pixels=-1):
+        '''
+        Write a link to another KML document that is loaded only when its region is on screen.
+
+        :param href: URL or relative path of the linked document.
+        :param bounds: [west, south, east, north] bounds of the linked placemarks in degrees.
+        :param name: name of the link.
+        :param min_lod_pixels: size of the region on screen, in pixels, at which the document gets loaded.
+        :param max_lod_pixels: size at which the document gets unloaded; -1 - never.
+        '''
+
+        self.write("    <NetworkLink>\n"
+                   "      <name>{}</name>\n"
+                   "      <Region>\n"
+                   "        <LatLonAltBox>\n"
+                   "          <north>{}</north>\n"
+                   "          <south>{}</south>\n"
+                   "          <east>{}</east>\n"
+                   "          <west>{}</west>\n"
+                   "        </LatLonAltBox>\n"
+                   "        <Lod>\n"
+                   "          <minLodPixels>{}</minLodPixels>\n"
+                   "          <maxLodPixels>{}</maxLodPixels>\n"
+                   "        </Lod>\n"
+                   "      </Region>\n"
+                   "      <Link>\n"
+                   "        <href>{}</href>\n"
+                   "        <viewRefreshMode>onRegion</viewRefreshMode>\n"
+                   "      </Link>\n"
+                   "    </NetworkLink>\n".format(name, bounds[3], bounds[1], bounds[2], bounds[0],
+                                                  min_lod_pixels, max_lod_pixels, href))
+
+        return
+
+
+
     def close(self):
         '''
         Finish and close KML file.
         '''
         
-        self.kml.write("  </Document>\n</kml>\n")
+        self.write("  </Document>\n</kml>\n")
+        self.flush()
         self.kml.close()
+
+        if self.zip != None:
+            self.zip.close()
         
         return
 
@@ -92,6 +245,156 @@ class KML:
 
 
 
+class KMLChunks(KML):
+    '''
+    KML output split into chunk files of at most max_placemarks placemarks each,
+    tied together by a master document at kml_file. The master holds a network link
+    per chunk with the region covered by the chunk's placemarks, so that viewers only load
+    chunks that are on screen. Chunks are named <kml_file stem>_0000.kml, _0001.kml, ...
+    (.kmz if the master is KMZ). Regions are compact when placemarks come in spatial order,
+    e.g. sorted by grid row and column.
+    '''
+
+    def __init__(self, kml_file, max_placemarks=10000, min_lod_pixels=128, buffer_size=1048576, kmz=None):
+        '''
+        Constructor...
+
+        :param kml_file: path to the master KML file to be generated.
+        :param max_placemarks: number of placemarks per chunk file.
+        :param min_lod_pixels: on-screen size of a chunk region, in pixels, at which the chunk gets loaded.
+        :param buffer_size: output buffer size of each file.
+        :param kmz: write zipped KMZ files; by default, decided by the extension of kml_file.
+        '''
+
+        self.kml_file = kml_file
+        self.max_placemarks = max_placemarks
+        self.min_lod_pixels = min_lod_pixels
+        self.buffer_size = buffer_size
+
+        stem, ext = posixpath.splitext(kml_file)
+        if kmz == None:
+            kmz = ext.lower() == ".kmz"
+        self.kmz = kmz
+        self.chunk_pattern = stem + "_{:04d}" + (".kmz" if kmz else ".kml")
+
+        # style() arguments, repeated in every chunk
+        self.styles = []
+
+        # (file name, [west, south, east, north]) of every chunk
+        self.chunks = []
+
+        self.chunk = None
+        self.count = 0
+        self.new_chunk()
+
+        return
+
+
+
+    def new_chunk(self):
+        '''
+        Close the current chunk file and start the next one.
+        '''
+
+        if self.chunk != None:
+            self.chunk.close()
+
+        chunk_file = self.chunk_pattern.format(len(self.chunks))
+        self.chunk = KML(chunk_file, buffer_size=self.buffer_size, kmz=self.kmz)
+        for s in self.styles:
+            self.chunk.style(*s)
+
+        self.chunks.append((chunk_file, [180.0, 90.0, -180.0, -90.0]))
+        self.count = 0
+
+        return
+
+
+
+    def write(self, text):
+        '''
+        Add text to the current chunk; network_link() writes through this as well.
+        '''
+
+        self.chunk.write(text)
+
+        return
+
+
+
+    def flush(self):
+        '''
+        Write out the output buffer of the current chunk.
+        '''
+
+        self.chunk.flush()
+
+        return
+
+
+
+    def style(self, style_id, line_width=1, line_color="00000000", poly_color="00000000"):
+        '''
+        Define a style in the current and all following chunks.
+        '''
+
+        self.styles.append((style_id, line_width, line_color, poly_color))
+        self.chunk.style(style_id, line_width, line_color, poly_color)
+
+        return
+
+
+
+    def multi_polygon(self, polygons, name="Poly", description=None, style="clr1"):
+        '''
+        Write a placemark to the current chunk, starting a new chunk if the current one is full.
+        '''
+
+        if self.count >= self.max_placemarks:
+            self.new_chunk()
+
+        bounds = self.chunks[-1][1]
+        for outer_boundary, inner_boundaries in polygons:
+            lons = [p[0] for p in outer_boundary]
+            lats = [p[1] for p in outer_boundary]
+            bounds[0], bounds[1] = min(bounds[0], min(lons)), min(bounds[1], min(lats))
+            bounds[2], bounds[3] = max(bounds[2], max(lons)), max(bounds[3], max(lats))
+
+        self.chunk.multi_polygon(polygons, name=name, description=description, style=style)
+        self.count += 1
+
+        return
+
+
+
+    def close(self):
+        '''
+        Close the last chunk and write the master document.
+        '''
+
+        self.chunk.close()
+
+        # relative links inside a KMZ resolve against the archive root,
+        # chunks next to the master KMZ are one level up from there
+        prefix = "../" if self.kmz else ""
+
+        master = KML(self.kml_file, buffer_size=self.buffer_size, kmz=self.kmz)
+        for k, (chunk_file, bounds) in enumerate(self.chunks):
+            if bounds[0] > bounds[2]:
+                # empty chunk
+                continue
+            master.network_link(prefix + posixpath.basename(chunk_file), bounds, name="Chunk {}".format(k),
+                                min_lod_pixels=self.min_lod_pixels)
+        master.close()
+
+        return
+
+
+
+
+
+
+
 #==============================================================================
 # Main function.
 #==============================================================================
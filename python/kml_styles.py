@@ -0,0 +1,158 @@
+"""
+
+Color styles for KML exports.
+
+The 'jet' color map is tabulated once with NumPy, the same way matplotlib does it,
+so exporters get identical colors without importing pyplot. Style IDs of all
+features are computed in one vectorized call.
+
+"""
+
+
+import sys
+import numpy as np
+
+
+# matplotlib's 'jet' color map: (x, value, value) breakpoints of red, green and blue
+JET_SEGMENTS = (
+    ((0.0, 0, 0), (0.35, 0, 0), (0.66, 1, 1), (0.89, 1, 1), (1.0, 0.5, 0.5)),
+    ((0.0, 0, 0), (0.125, 0, 0), (0.375, 1, 1), (0.64, 1, 1), (0.91, 0, 0), (1.0, 0, 0)),
+    ((0.0, 0.5, 0.5), (0.11, 1, 1), (0.34, 1, 1), (0.65, 0, 0), (1.0, 0, 0)),
+)
+
+# number of entries in a color lookup table, same as in matplotlib
+LUT_SIZE = 256
+
+
+
+def make_lut(segments, size=LUT_SIZE):
+    '''
+    Tabulate a color map given by linear segments.
+
+    :param segments: red, green and blue lists of (x, value, value) breakpoints.
+    :param size: number of table entries.
+
+    :return: Array of shape (size, 3) with RGB values in [0, 1].
+    '''
+
+    x = np.linspace(0, 1, size)
+    lut = np.empty((size, 3))
+    for c, s in enumerate(segments):
+        lut[:, c] = np.interp(x, [p[0] for p in s], [p[1] for p in s])
+
+    return lut
+
+
+
+JET = make_lut(JET_SEGMENTS)
+
+
+
+def colormap(x, lut=JET):
+    '''
+    Look up colors of values in [0, 1]; values outside are clipped.
+
+    :param x: array of values.
+    :param lut: color lookup table built by make_lut().
+
+    :return: Array of shape (N, 3) with RGB values in [0, 1].
+    '''
+
+    idx = np.clip((np.asarray(x, dtype=float) * len(lut)).astype(int), 0, len(lut) - 1)
+
+    return lut[idx]
+
+
+
+def kml_colors(num_colors, alpha="7F", lut=JET):
+    '''
+    KML colors of style IDs 0, 1, ..., num_colors, i.e. of color map values i / num_colors.
+
+    :param num_colors: number of colors.
+    :param alpha: hexadecimal opacity.
+    :param lut: color lookup table built by make_lut().
+
+    :return: List of num_colors + 1 "AABBGGRR" strings.
+    '''
+
+    rgb = (255 * colormap(np.arange(int(num_colors) + 1) / float(num_colors), lut)).astype(int)
+
+    return ["{}{:02X}{:02X}{:02X}".format(alpha, b, g, r) for r, g, b in rgb.tolist()]
+
+
+
+def write_styles(K, num_colors, alpha="7F"):
+    '''
+    Define styles clr0, clr1, ..., clr<num_colors> in a KML document.
+
+    :param K: KML object.
+    :param num_colors: number of colors.
+    :param alpha: hexadecimal opacity.
+    '''
+
+    for i, color in enumerate(kml_colors(num_colors, alpha)):
+        K.style("clr{}".format(i), poly_color=color)
+
+    return
+
+
+
+def value_range(values, min=0, max=0):
+    '''
+    Extend a range of values by given values.
+
+    :param values: array of values.
+    :param min: initial minimum.
+    :param max: initial maximum.
+
+    :return: Tuple (min, max).
+    '''
+
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return (min, max)
+
+    return (np.minimum(min, np.min(values)), np.maximum(max, np.max(values)))
+
+
+
+def style_ids(values, min, max, num_colors):
+    '''
+    Color indices of values scaled from [min, max] to [0, num_colors], capped at num_colors.
+
+    :param values: array of values.
+    :param min: value mapped to index 0.
+    :param max: value mapped to index num_colors.
+    :param num_colors: number of colors.
+
+    :return: Integer array of style indices.
+    '''
+
+    span = float(max - min) if max > min else 1.0
+    ids = np.round((np.asarray(values, dtype=float) - min) * num_colors / span)
+
+    return np.minimum(num_colors, ids).astype(int)
+
+
+
+
+
+
+
+
+
+#==============================================================================
+# Main function.
+#==============================================================================
+def main(argv):
+    print(__doc__)
+
+
+
+
+
+
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -91,34 +91,23 @@ def get_passenger_totals(table, dow, begin_time, end_time):
 
 
 def make_boxes(bb, stops):
-    boxes = dict()
+    data = stops['data']
 
     thres = 0
 
-    for s in stops['data']:
-        if (s['on'] < thres) and (s['off'] < thres):
-            continue
+    lat = np.array([float(s['lat']) for s in data])
+    lon = np.array([float(s['lon']) for s in data])
+    on = np.array([s['on'] for s in data], dtype=np.int64)
+    off = np.array([s['off'] for s in data], dtype=np.int64)
+    load = np.array([s['load'] for s in data], dtype=np.int64)
 
-        lat, lon = float(s['lat']), float(s['lon'])
-        if lat < 37 or lon > 121:
-            continue
-
-        addr = bb.box_address(lat, lon)
-        if addr not in boxes.keys():
-            boxes[addr] = {'on': 0, 'off': 0, 'load': 0, 'num_stops': 0, 'metric': 0, 'stops': []}
+    keep = ~((on < thres) & (off < thres)) & ~((lat < 37) | (lon > 121))
 
-        boxes[addr]['on'] += s['on']
-        boxes[addr]['off'] += s['off']
-        boxes[addr]['load'] += s['load']
-        boxes[addr]['num_stops'] += 1
-        boxes[addr]['stops'].append(s)
-        boxes[addr]['metric'] = np.max([boxes[addr]['on'], boxes[addr]['off']])
+    return bb.aggregate(lat[keep], lon[keep], on[keep], off[keep], load[keep])
 
-    return boxes
 
 
-
-def make_tracts(ct, stops):
+def make_tracts(ct, stops, max_distance=200):
     tracts = dict()
 
     thres = 0
@@ -135,8 +124,11 @@ def make_tracts(ct, stops):
 
         key = ct.tract_address_by_stop(s['id'])
         if key == None:
-            print("Not found")
-            continue
+            key, dist = ct.nearest_tract(lat, lon, max_distance=max_distance)
+            if key == None:
+                print("Not found: stop {} ({}, {})".format(s['id'], lat, lon))
+                continue
+            print("Stop {} assigned to nearest tract {} ({:.1f} m away)".format(s['id'], key, dist))
 
         meta = ct.tract_meta(key)
         if key not in tracts.keys():
@@ -198,9 +190,7 @@ def run(args):
     boxes = make_boxes(bb, stops)
     print("Made boxes!")
 
-    box_list = u.dict2list(boxes)
-    box_list = sorted(box_list, key=lambda i: i[sort_key], reverse=True)[0:cut_off]
-    boxes = u.list2dict(box_list)
+    boxes = bb.top(boxes, sort_key, cut_off)
 
     bb.make_shapefile(boxes, boxes_shp)
     print("Created shapefile '{}'!".format(boxes_shp))
@@ -212,7 +202,7 @@ def run(args):
 
     ### CENSUS TRACTS ###
 
-    ct = CT()
+    ct = CT(lazy=True)
     tracts = make_tracts(ct, stops)
     print("Made tracts!")
 
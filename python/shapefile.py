@@ -15,6 +15,7 @@ import os
 import sys
 import time
 import array
+import mmap
 import tempfile
 import itertools
 
@@ -212,6 +213,17 @@ class Reader:
     You can instantiate a Reader without specifying a shapefile
     and then specify one later with the load() method.
 
+    With the keyword argument numpy=True, the points of each shape
+    are read with a single numpy.frombuffer() call into an (N, 2)
+    float64 array instead of a list of per-vertex arrays, and z and
+    m values become float64 arrays, with m nodata values as NaN.
+
+    With mmap=True (which implies numpy=True), the .shp, .shx and
+    .dbf files are memory-mapped. Shape coordinates are then views
+    into the mapped .shp file rather than copies, and shape(i) looks
+    up the record offset read from the .shx file in one pass, without
+    any file system calls.
+
     Only the shapefile headers are read upon loading. Content
     within each file is only accessed when required and as
     efficiently as possible. Shapefiles are usually not large
@@ -227,6 +239,9 @@ class Reader:
         self.numRecords = None
         self.fields = []
         self.__dbfHdrLength = 0
+        self.__recFmt = None
+        self.memoryMap = kwargs.get("mmap", False)
+        self.numpy = kwargs.get("numpy", False) or self.memoryMap
         # See if a shapefile name was passed as an argument
         if len(args) > 0:
             if is_string(args[0]):
@@ -272,11 +287,37 @@ class Reader:
                 self.dbf = open("%s.dbf" % shapeName, "rb")
             except IOError:
                 raise ShapefileException("Unable to open %s.dbf" % shapeName)
+        if self.memoryMap:
+            self.shp = self.__mapFile(self.shp)
+            self.shx = self.__mapFile(self.shx)
+            self.dbf = self.__mapFile(self.dbf)
         if self.shp:
             self.__shpHeader()
         if self.dbf:
             self.__dbfHeader()
 
+    def __mapFile(self, f):
+        """Memory-maps a file object for reading. Objects that cannot be
+        mapped, such as in-memory streams or empty files, are returned as is."""
+        if not f or isinstance(f, mmap.mmap):
+            return f
+        try:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, IOError, ValueError):
+            return f
+        m.seek(f.tell())
+        return m
+
+    def __readDoubles(self, f, n):
+        """Reads n little-endian doubles as a numpy array: a view into
+        the buffer for memory-mapped files, a copy otherwise."""
+        import numpy as np
+        if isinstance(f, mmap.mmap):
+            a = np.frombuffer(f, dtype="<f8", count=n, offset=f.tell())
+            f.seek(n * 8, 1)
+            return a
+        return np.frombuffer(f.read(n * 8), dtype="<f8")
+
     def __getFileObj(self, f):
         """Checks to see if the requested shapefile file object is
         available. If not a ShapefileException is raised."""
@@ -344,26 +385,42 @@ class Reader:
         # Read part types for Multipatch - 31
         if shapeType == 31:
             record.partTypes = _Array('i', unpack("<%si" % nParts, f.read(nParts * 4)))
+        if self.numpy:
+            import numpy as np
+            readDoubles = self.__readDoubles
         # Read points - produces a list of [x,y] values
         if nPoints:
-            record.points = [_Array('d', unpack("<2d", f.read(16))) for p in range(nPoints)]
+            if self.numpy:
+                record.points = readDoubles(f, 2 * nPoints).reshape(nPoints, 2)
+            else:
+                record.points = [_Array('d', unpack("<2d", f.read(16))) for p in range(nPoints)]
         # Read z extremes and values
         if shapeType in (13,15,18,31):
             (zmin, zmax) = unpack("<2d", f.read(16))
-            record.z = _Array('d', unpack("<%sd" % nPoints, f.read(nPoints * 8)))
+            if self.numpy:
+                record.z = readDoubles(f, nPoints)
+            else:
+                record.z = _Array('d', unpack("<%sd" % nPoints, f.read(nPoints * 8)))
         # Read m extremes and values if header m values do not equal 0.0
         if shapeType in (13,15,18,23,25,28,31) and not 0.0 in self.measure:
             (mmin, mmax) = unpack("<2d", f.read(16))
             # Measure values less than -10e38 are nodata values according to the spec
-            record.m = []
-            for m in _Array('d', unpack("<%sd" % nPoints, f.read(nPoints * 8))):
-                if m > -10e38:
-                    record.m.append(m)
-                else:
-                    record.m.append(None)
+            if self.numpy:
+                m = readDoubles(f, nPoints)
+                record.m = np.where(m > -10e38, m, np.nan)
+            else:
+                record.m = []
+                for m in _Array('d', unpack("<%sd" % nPoints, f.read(nPoints * 8))):
+                    if m > -10e38:
+                        record.m.append(m)
+                    else:
+                        record.m.append(None)
         # Read a single point
         if shapeType in (1,11,21):
-            record.points = [_Array('d', unpack("<2d", f.read(16)))]
+            if self.numpy:
+                record.points = readDoubles(f, 2).reshape(1, 2)
+            else:
+                record.points = [_Array('d', unpack("<2d", f.read(16)))]
         # Read a single Z value
         if shapeType == 11:
             record.z = unpack("<d", f.read(8))
@@ -389,10 +446,16 @@ class Reader:
             numRecords = shxRecordLength // 8
             # Jump to the first record.
             shx.seek(100)
-            for r in range(numRecords):
-                # Offsets are 16-bit words just like the file length
-                self._offsets.append(unpack(">i", shx.read(4))[0] * 2)
-                shx.seek(shx.tell() + 4)
+            if self.numpy:
+                # Offsets and content lengths interleaved, read in one pass
+                import numpy as np
+                index = np.frombuffer(shx.read(numRecords * 8), dtype=">i4")
+                self._offsets = (index[0::2].astype(np.int64) * 2).tolist()
+            else:
+                for r in range(numRecords):
+                    # Offsets are 16-bit words just like the file length
+                    self._offsets.append(unpack(">i", shx.read(4))[0] * 2)
+                    shx.seek(shx.tell() + 4)
         if not i == None:
             return self._offsets[i]
 
@@ -465,6 +528,7 @@ class Reader:
             fieldDesc[name] = fieldDesc[name].lstrip()
             fieldDesc[1] = u(fieldDesc[1])
             self.fields.append(fieldDesc)
+        self.__recFmt = None
         terminator = dbf.read(1)
         if terminator != b("\r"):
             raise ShapefileException("Shapefile dbf header lacks expected terminator. (likely corrupt?)")
@@ -474,9 +538,11 @@ class Reader:
         """Calculates the size of a .shp geometry record."""
         if not self.numRecords:
             self.__dbfHeader()
-        fmt = ''.join(['%ds' % fieldinfo[2] for fieldinfo in self.fields])
-        fmtSize = calcsize(fmt)
-        return (fmt, fmtSize)
+        if not self.__recFmt:
+            fmt = ''.join(['%ds' % fieldinfo[2] for fieldinfo in self.fields])
+            fmtSize = calcsize(fmt)
+            self.__recFmt = (fmt, fmtSize)
+        return self.__recFmt
 
     def __record(self):
         """Reads and returns a dbf record row as a list of values."""
@@ -553,6 +619,87 @@ class Reader:
                 records.append(r)
         return records
 
+    def records_columns(self, fields=None):
+        """Returns dbf records as columns, decoding only the requested fields.
+        The whole dbf body is viewed as a numpy structured array with just
+        these fields, and every field is decoded in one vectorized pass.
+        Returns a dictionary mapping field names to numpy arrays in file
+        order, without deleted records. Numeric (N) fields become int64
+        arrays, or float64 arrays if they have decimals or missing values
+        (NaN); other fields become arrays of stripped strings."""
+        import numpy as np
+        if not self.numRecords:
+            self.__dbfHeader()
+        f = self.__getFileObj(self.dbf)
+        fieldNames = [field[0] for field in self.fields[1:]]
+        if fields is None:
+            fields = fieldNames
+        # Position of every field within a record, after the deletion flag
+        layout = {}
+        offset = 0
+        for (name, typ, size, deci) in self.fields:
+            if name not in layout:
+                layout[name] = (offset, typ, size, deci)
+            offset += size
+        for name in fields:
+            if name not in fieldNames:
+                raise ShapefileException("Field %s not found in dbf file." % name)
+        recSize = self.__recordFmt()[1]
+        dtype = np.dtype({'names': ['flag'] + ['f%d' % k for k in range(len(fields))],
+                          'formats': ['S1'] + ['S%d' % layout[name][2] for name in fields],
+                          'offsets': [0] + [layout[name][0] for name in fields],
+                          'itemsize': recSize})
+        start = self.__dbfHeaderLength()
+        if isinstance(f, mmap.mmap):
+            table = np.frombuffer(f, dtype=dtype, count=self.numRecords, offset=start)
+        else:
+            f.seek(start)
+            table = np.frombuffer(f.read(self.numRecords * recSize), dtype=dtype)
+        keep = table['flag'] == b(' ')
+        columns = {}
+        for k, name in enumerate(fields):
+            col = table['f%d' % k]
+            if not keep.all():
+                col = col[keep]
+            (offset, typ, size, deci) = layout[name]
+            if typ == "N":
+                columns[name] = self.__numericColumn(col, deci)
+            else:
+                columns[name] = self.__stringColumn(col)
+        return columns
+
+    def __stringColumn(self, col):
+        """Decodes an array of dbf text field values, as in __record()."""
+        import numpy as np
+        col = np.ascontiguousarray(np.char.strip(col))
+        if (col.view(np.uint8) < 128).all():
+            # Plain ASCII casts to str without decoding value by value
+            return col.astype('U%d' % max(1, col.dtype.itemsize))
+        return np.char.decode(col, 'utf-8', 'replace')
+
+    def __numericColumn(self, col, deci):
+        """Decodes an array of dbf numeric field values, as in __record()."""
+        import numpy as np
+        col = np.char.strip(np.char.replace(np.char.replace(col, b('\0'), b('')), b('*'), b('')))
+        missing = col == b('')
+        try:
+            if deci or missing.any():
+                values = np.where(missing, b('nan'), col).astype(np.float64)
+                if not deci:
+                    # Integers must parse as integers
+                    col[~missing].astype(np.int64)
+                return values
+            return col.astype(np.int64)
+        except ValueError:
+            # Values not parseable as numbers become NaN
+            values = np.full(len(col), np.nan)
+            for i, value in enumerate(col.tolist()):
+                try:
+                    values[i] = float(value) if deci else int(value)
+                except ValueError:
+                    pass
+            return values
+
     def iterRecords(self):
         """Serves up records in a dbf file as an iterator.
         Useful for large shapefiles or dbf files."""
@@ -0,0 +1,121 @@
+"""
+Tests of tract lookup in ctract.CT.
+"""
+
+
+import os
+import numpy as np
+import shapefile as shp
+import ctract
+from ctract import CT
+
+
+
+def square(lon, lat, size=0.01):
+    '''
+    TSV shape string of a closed square ring with the lower left corner at (lon, lat).
+    '''
+
+    ring = [(lon, lat), (lon + size, lat), (lon + size, lat + size), (lon, lat + size), (lon, lat)]
+
+    return " ".join(["{},{}".format(x, y) for x, y in ring])
+
+
+
+def test_duplicate_tract_key_last_wins(tmp_path):
+    ctfile = tmp_path / "tracts.tsv"
+    with open(ctfile, "w") as f:
+        f.write("census tract\tfull id\tshape\n")
+        f.write("118\t06045011800\t{}\n".format(square(-122.30, 37.80)))
+        f.write("201\t06001020100\t{}\n".format(square(-122.20, 37.80)))
+        f.write("118\t06075011800\t{}\n".format(square(-122.40, 37.79)))
+
+    ct = CT(ctfile=str(ctfile), stfile=str(tmp_path / "none.csv"))
+
+    assert list(ct.tracts.keys()) == ["118", "201"]
+    assert ct.tracts["118"]["full_id"] == "06075011800"
+    assert np.allclose(ct.tracts["118"]["geometry"][0], [-122.40, 37.79])
+    assert len(ct.polygons) == 2
+
+    lats = np.array([37.795, 37.805, 37.805])
+    lons = np.array([-122.395, -122.195, -122.295])
+    assert [ct.tract_address(lat, lon) for lat, lon in zip(lats, lons)] == ["118", "201", None]
+    assert list(ct.tract_addresses(lats, lons)) == ["118", "201", None]
+
+
+
+def test_grid_rebuilt_when_tract_file_restored_with_older_mtime(tmp_path):
+    ctfile = tmp_path / "tracts.tsv"
+    with open(ctfile, "w") as f:
+        f.write("census tract\tfull id\tshape\n")
+        f.write("118\t06075011800\t{}\n".format(square(-122.40, 37.79)))
+        f.write("201\t06001020100\t{}\n".format(square(-122.20, 37.80)))
+    ct = CT(ctfile=str(ctfile), stfile=str(tmp_path / "none.csv"))
+    assert ct.tract_address(37.795, -122.395) == "118"
+
+    with open(ctfile, "w") as f:
+        f.write("census tract\tfull id\tshape\n")
+        f.write("118\t06075011800\t{}\n".format(square(-122.30, 37.79)))
+        f.write("201\t06001020100\t{}\n".format(square(-122.20, 37.80)))
+    os.utime(ctfile, ns=(1, 1))
+
+    ct = CT(ctfile=str(ctfile), stfile=str(tmp_path / "none.csv"))
+    assert ct.tract_address(37.795, -122.395) == None
+    assert ct.tract_address(37.795, -122.295) == "118"
+    assert list(ct.tract_addresses(np.array([37.795]), np.array([-122.295]))) == ["118"]
+
+
+
+def test_exports_skip_tract_geometry(tmp_path):
+    ctfile = tmp_path / "tracts.tsv"
+    with open(ctfile, "w") as f:
+        f.write("census tract\tfull id\tshape\n")
+        f.write("118\t06075011800\t{}\n".format(square(-122.40, 37.79)))
+        f.write("201\t06001020100\t{}\n".format(square(-122.20, 37.80)))
+    ct = CT(ctfile=str(ctfile), stfile=str(tmp_path / "none.csv"))
+
+    tracts = dict()
+    for key in ["118", "201"]:
+        tracts[key] = {'metric': 5000, 'stops': [], 'geometry': ct.tract_meta(key)['geometry']}
+
+    shpfile = str(tmp_path / "tracts.shp")
+    ct.make_shapefile(tracts, shpfile)
+    sf = shp.Reader(shpfile)
+    assert [f[0] for f in sf.fields[1:]] == ["Tract", "metric"]
+    assert [list(r) for r in sf.records()] == [["118", "5000"], ["201", "5000"]]
+
+    kmlfile = str(tmp_path / "tracts.kml")
+    ct.make_kml(tracts, kmlfile)
+    with open(kmlfile, "r") as f:
+        kml = f.read()
+    assert kml.count("<Placemark>") == 2
+    assert "geometry" not in kml
+    assert "metric: 5000" in kml
+
+
+
+def test_cache_and_grid_signatures_updated_on_touch(tmp_path, monkeypatch):
+    ctfile = tmp_path / "tracts.tsv"
+    with open(ctfile, "w") as f:
+        f.write("census tract\tfull id\tshape\n")
+        f.write("118\t06075011800\t{}\n".format(square(-122.40, 37.79)))
+    CT(ctfile=str(ctfile), stfile=str(tmp_path / "none.csv"))
+    os.utime(ctfile, ns=(1, 1))
+
+    CT(ctfile=str(ctfile), stfile=str(tmp_path / "none.csv"))
+    with open(tmp_path / "tracts.cache" / "signature.txt", "r") as f:
+        assert f.read().split()[0] == "1"
+    with np.load(tmp_path / "tracts.grid.npz") as data:
+        assert data['signature'][0] == "1"
+
+    hashed = []
+    signature = ctract.file_signature
+    def file_signature(path, digest=False):
+        if digest:
+            hashed.append(path)
+        return signature(path, digest)
+    monkeypatch.setattr(ctract, "file_signature", file_signature)
+
+    ct = CT(ctfile=str(ctfile), stfile=str(tmp_path / "none.csv"))
+    assert ct.tract_address(37.795, -122.395) == "118"
+    assert hashed == []
@@ -0,0 +1,16 @@
+"""
+Tests that importing modules does not load heavy packages, see import_benchmark.
+"""
+
+
+import pytest
+from import_benchmark import time_import
+
+
+
+@pytest.mark.parametrize("module", ["tsv2csv", "util", "ctract"])
+def test_import_loads_no_heavy_package(module):
+    dt, heavy = time_import(module, runs=1)
+
+    assert dt != None, heavy
+    assert heavy == [], "{} loads {}".format(module, ", ".join(heavy))
@@ -4,11 +4,7 @@ Convert TSV file to CSV.
 
 import sys
 import posixpath
-import pickle
 import re
-import numpy as np
-import matplotlib.pyplot as plt
-import datetime
 
 
 # ==============================================================================
@@ -5,12 +5,112 @@ Utilities...
 """
 
 import sys
-import urllib
+import os
+import logging
 import posixpath
-import re
-import numpy as np
-import matplotlib.pyplot as plt
-import datetime
+
+
+# WKT of common coordinate systems by EPSG code, so that .prj files can be written offline
+EPSG_WKT = {
+    # WGS 84
+    4326: ('GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],'
+           'AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],'
+           'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]'),
+    # NAD83
+    4269: ('GEOGCS["NAD83",DATUM["North_American_Datum_1983",SPHEROID["GRS 1980",6378137,298.257222101,AUTHORITY["EPSG","7019"]],'
+           'AUTHORITY["EPSG","6269"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],'
+           'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4269"]]'),
+    # NAD83 / UTM zone 10N
+    26910: ('PROJCS["NAD83 / UTM zone 10N",GEOGCS["NAD83",DATUM["North_American_Datum_1983",SPHEROID["GRS 1980",6378137,298.257222101,AUTHORITY["EPSG","7019"]],'
+            'AUTHORITY["EPSG","6269"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],'
+            'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4269"]],'
+            'PROJECTION["Transverse_Mercator"],PARAMETER["latitude_of_origin",0],'
+            'PARAMETER["central_meridian",-123],PARAMETER["scale_factor",0.9996],'
+            'PARAMETER["false_easting",500000],PARAMETER["false_northing",0],'
+            'UNIT["metre",1,AUTHORITY["EPSG","9001"]],AXIS["Easting",EAST],AXIS["Northing",NORTH],'
+            'AUTHORITY["EPSG","26910"]]'),
+    # NAD83 / UTM zone 11N
+    26911: ('PROJCS["NAD83 / UTM zone 11N",GEOGCS["NAD83",DATUM["North_American_Datum_1983",SPHEROID["GRS 1980",6378137,298.257222101,AUTHORITY["EPSG","7019"]],'
+            'AUTHORITY["EPSG","6269"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],'
+            'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4269"]],'
+            'PROJECTION["Transverse_Mercator"],PARAMETER["latitude_of_origin",0],'
+            'PARAMETER["central_meridian",-117],PARAMETER["scale_factor",0.9996],'
+            'PARAMETER["false_easting",500000],PARAMETER["false_northing",0],'
+            'UNIT["metre",1,AUTHORITY["EPSG","9001"]],AXIS["Easting",EAST],AXIS["Northing",NORTH],'
+            'AUTHORITY["EPSG","26911"]]'),
+    # WGS 84 / UTM zone 10N
+    32610: ('PROJCS["WGS 84 / UTM zone 10N",GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],'
+            'AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],'
+            'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]],'
+            'PROJECTION["Transverse_Mercator"],PARAMETER["latitude_of_origin",0],'
+            'PARAMETER["central_meridian",-123],PARAMETER["scale_factor",0.9996],'
+            'PARAMETER["false_easting",500000],PARAMETER["false_northing",0],'
+            'UNIT["metre",1,AUTHORITY["EPSG","9001"]],AXIS["Easting",EAST],AXIS["Northing",NORTH],'
+            'AUTHORITY["EPSG","32610"]]'),
+    # WGS 84 / UTM zone 11N
+    32611: ('PROJCS["WGS 84 / UTM zone 11N",GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],'
+            'AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],'
+            'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]],'
+            'PROJECTION["Transverse_Mercator"],PARAMETER["latitude_of_origin",0],'
+            'PARAMETER["central_meridian",-117],PARAMETER["scale_factor",0.9996],'
+            'PARAMETER["false_easting",500000],PARAMETER["false_northing",0],'
+            'UNIT["metre",1,AUTHORITY["EPSG","9001"]],AXIS["Easting",EAST],AXIS["Northing",NORTH],'
+            'AUTHORITY["EPSG","32611"]]'),
+    # NAD83 / California zone 2
+    26942: ('PROJCS["NAD83 / California zone 2",GEOGCS["NAD83",DATUM["North_American_Datum_1983",SPHEROID["GRS 1980",6378137,298.257222101,AUTHORITY["EPSG","7019"]],'
+            'AUTHORITY["EPSG","6269"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],'
+            'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4269"]],'
+            'PROJECTION["Lambert_Conformal_Conic_2SP"],'
+            'PARAMETER["latitude_of_origin",37.6666666666667],PARAMETER["central_meridian",-122],'
+            'PARAMETER["standard_parallel_1",39.8333333333333],'
+            'PARAMETER["standard_parallel_2",38.3333333333333],PARAMETER["false_easting",2000000],'
+            'PARAMETER["false_northing",500000],UNIT["metre",1,AUTHORITY["EPSG","9001"]],'
+            'AXIS["Easting",EAST],AXIS["Northing",NORTH],AUTHORITY["EPSG","26942"]]'),
+    # NAD83 / California zone 3
+    26943: ('PROJCS["NAD83 / California zone 3",GEOGCS["NAD83",DATUM["North_American_Datum_1983",SPHEROID["GRS 1980",6378137,298.257222101,AUTHORITY["EPSG","7019"]],'
+            'AUTHORITY["EPSG","6269"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],'
+            'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4269"]],'
+            'PROJECTION["Lambert_Conformal_Conic_2SP"],PARAMETER["latitude_of_origin",36.5],'
+            'PARAMETER["central_meridian",-120.5],PARAMETER["standard_parallel_1",38.4333333333333],'
+            'PARAMETER["standard_parallel_2",37.0666666666667],PARAMETER["false_easting",2000000],'
+            'PARAMETER["false_northing",500000],UNIT["metre",1,AUTHORITY["EPSG","9001"]],'
+            'AXIS["Easting",EAST],AXIS["Northing",NORTH],AUTHORITY["EPSG","26943"]]'),
+    # NAD83 / California zone 2 (ftUS)
+    2226: ('PROJCS["NAD83 / California zone 2 (ftUS)",GEOGCS["NAD83",DATUM["North_American_Datum_1983",SPHEROID["GRS 1980",6378137,298.257222101,AUTHORITY["EPSG","7019"]],'
+           'AUTHORITY["EPSG","6269"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],'
+           'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4269"]],'
+           'PROJECTION["Lambert_Conformal_Conic_2SP"],'
+           'PARAMETER["latitude_of_origin",37.6666666666667],PARAMETER["central_meridian",-122],'
+           'PARAMETER["standard_parallel_1",39.8333333333333],'
+           'PARAMETER["standard_parallel_2",38.3333333333333],PARAMETER["false_easting",6561666.667],'
+           'PARAMETER["false_northing",1640416.667],'
+           'UNIT["US survey foot",0.304800609601219,AUTHORITY["EPSG","9003"]],AXIS["Easting",EAST],'
+           'AXIS["Northing",NORTH],AUTHORITY["EPSG","2226"]]'),
+    # NAD83 / California zone 3 (ftUS)
+    2227: ('PROJCS["NAD83 / California zone 3 (ftUS)",GEOGCS["NAD83",DATUM["North_American_Datum_1983",SPHEROID["GRS 1980",6378137,298.257222101,AUTHORITY["EPSG","7019"]],'
+           'AUTHORITY["EPSG","6269"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],'
+           'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4269"]],'
+           'PROJECTION["Lambert_Conformal_Conic_2SP"],PARAMETER["latitude_of_origin",36.5],'
+           'PARAMETER["central_meridian",-120.5],PARAMETER["standard_parallel_1",38.4333333333333],'
+           'PARAMETER["standard_parallel_2",37.0666666666667],PARAMETER["false_easting",6561666.667],'
+           'PARAMETER["false_northing",1640416.667],'
+           'UNIT["US survey foot",0.304800609601219,AUTHORITY["EPSG","9003"]],AXIS["Easting",EAST],'
+           'AXIS["Northing",NORTH],AUTHORITY["EPSG","2227"]]'),
+    # NAD83 / California Albers
+    3310: ('PROJCS["NAD83 / California Albers",GEOGCS["NAD83",DATUM["North_American_Datum_1983",SPHEROID["GRS 1980",6378137,298.257222101,AUTHORITY["EPSG","7019"]],'
+           'AUTHORITY["EPSG","6269"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],'
+           'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4269"]],'
+           'PROJECTION["Albers_Conic_Equal_Area"],PARAMETER["latitude_of_center",0],'
+           'PARAMETER["longitude_of_center",-120],PARAMETER["standard_parallel_1",34],'
+           'PARAMETER["standard_parallel_2",40.5],PARAMETER["false_easting",0],'
+           'PARAMETER["false_northing",-4000000],UNIT["metre",1,AUTHORITY["EPSG","9001"]],'
+           'AXIS["Easting",EAST],AXIS["Northing",NORTH],AUTHORITY["EPSG","3310"]]'),
+}
+
+# directory where WKT of other EPSG codes is kept once downloaded
+WKT_CACHE_DIR = posixpath.join(posixpath.expanduser("~"), ".cache", "covid_transit", "wkt")
+
+WKT_URL = "http://spatialreference.org/ref/epsg/{0}/prettywkt/"
 
 
 
@@ -67,7 +167,54 @@ def list2dict(l):
 
 
 
-def make_wkt_projection(shpfile, epsg_code=4326):
+def get_wkt_projection(epsg_code=4326, cache_dir=None):
+    '''
+    Get WKT of a coordinate system, with spaces and line breaks removed.
+    Common codes come from EPSG_WKT; others are read from the cache directory,
+    or downloaded from spatialreference.org once and then cached.
+
+    :param epsg_code: EPSG code.
+    :param cache_dir: cache directory; default - WKT_CACHE_DIR.
+
+    :return: WKT string, or None if it is not available.
+    '''
+
+    epsg_code = int(epsg_code)
+
+    if epsg_code in EPSG_WKT.keys():
+        wkt = EPSG_WKT[epsg_code]
+    else:
+        if cache_dir == None:
+            cache_dir = WKT_CACHE_DIR
+        cache_file = posixpath.join(cache_dir, "{}.wkt".format(epsg_code))
+
+        if posixpath.isfile(cache_file):
+            with open(cache_file, 'r') as f:
+                wkt = f.read()
+                f.close()
+        else:
+            import urllib.request
+
+            try:
+                wkt = urllib.request.urlopen(WKT_URL.format(epsg_code)).read().decode('utf-8')
+            except IOError as err:
+                logging.error("get_wkt_projection(): Cannot get WKT for EPSG:{}: {}.".format(epsg_code, err))
+                return None
+
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                with open(cache_file, 'w') as f:
+                    f.write(wkt)
+                    f.close()
+            except IOError as err:
+                logging.warning("get_wkt_projection(): Cannot cache WKT in \"{}\": {}.".format(cache_file, err))
+
+    # remove spaces between charachters and place all the text on one line
+    return wkt.replace(" ", "").replace("\n", "")
+
+
+
+def make_wkt_projection(shpfile, epsg_code=4326, cache_dir=None):
     '''
     Make projection file.
 
@@ -75,15 +222,13 @@ def make_wkt_projection(shpfile, epsg_code=4326):
            The World Geodetic System of 1984 is the geographic coordinate system (the three-dimensional one)
            used by GPS to express locations on the earth. WGS84 is the defined coordinate system for GeoJSON,
            as longitude and latitude in decimal degrees.
+    :param cache_dir: directory with WKT of EPSG codes missing in EPSG_WKT, see get_wkt_projection().
     :return:
     '''
 
-    # access projection information
-    wkt = urllib.request.urlopen("http://spatialreference.org/ref/epsg/{0}/prettywkt/".format(epsg_code))
-    # remove spaces between charachters
-    remove_spaces = wkt.read().decode('utf-8').replace(" ", "")
-    # place all the text on one line
-    output = remove_spaces.replace("\n", "")
+    output = get_wkt_projection(epsg_code, cache_dir)
+    if output == None:
+        return
 
     prjfile = posixpath.splitext(shpfile)[0] + ".prj"
     with open(prjfile, 'w+') as prj: